@@ -0,0 +1,230 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import os.path
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from recognition.video.recognizers import (VideoRecognitionNaive, VideoRecognitionCells,
+                                           VideoRecognitionPySceneDetect, VideoRecognitionPackets)
+from recognition.video.image_uploaders import ImageSaverBase
+from cli.synopsis import get_stats
+
+logging.basicConfig(format='[%(asctime)s]%(levelname)s:%(name)s:%(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+RECOGNIZERS = [
+    ('naive', VideoRecognitionNaive, {}),
+    ('cells', VideoRecognitionCells, {}),
+    ('pyscene', VideoRecognitionPySceneDetect, {'threshold': 0.12}),
+    ('packets', VideoRecognitionPackets, {}),
+    ('cells-packets', VideoRecognitionCells, {'packet_prefilter': True}),
+]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark of the keyframe recognizers on synthetic videos')
+
+    parser.add_argument('-r', '--resolutions',
+                        help='Resolutions of the videos, e.g. 640x360.',
+                        nargs='+',
+                        default=['640x360', '1280x720'])
+
+    parser.add_argument('-l', '--lengths',
+                        help='Lengths of the videos in seconds.',
+                        nargs='+',
+                        type=int,
+                        default=[60, 300])
+
+    parser.add_argument('--fps',
+                        type=int,
+                        default=25)
+
+    parser.add_argument('--slide-sec',
+                        help='Mean time between slide changes in seconds.',
+                        type=float,
+                        default=20)
+
+    parser.add_argument('--recognizers',
+                        nargs='+',
+                        choices=[name for name, _, _ in RECOGNIZERS],
+                        default=[name for name, _, _ in RECOGNIZERS])
+
+    parser.add_argument('--videos-dir',
+                        help='Directory for the generated videos, a temporary one by default.')
+
+    parser.add_argument('-o', '--output',
+                        help='Path to json with the results.')
+
+    return parser.parse_args()
+
+
+def make_slide(width, height, seed):
+    random_state = np.random.RandomState(seed)
+    slide = np.full((height, width, 3), 235, dtype=np.uint8)
+    cv2.rectangle(slide, (width // 20, height // 20), (width - width // 20, height // 7), (120, 60, 20), cv2.FILLED)
+    for i in range(random_state.randint(4, 10)):
+        y = height // 5 + i * height // 14
+        x = width // 10 + random_state.randint(0, width // 10)
+        line_width = random_state.randint(width // 5, width // 2)
+        cv2.rectangle(slide, (x, y), (x + line_width, y + height // 40), (40, 40, 40), cv2.FILLED)
+    return slide
+
+
+def draw_presenter(frame, center_x):
+    height, width = frame.shape[:2]
+    head_radius = height // 12
+    head_center = (int(center_x), height // 3)
+    cv2.rectangle(frame, (int(center_x - 2 * head_radius), head_center[1] + head_radius),
+                  (int(center_x + 2 * head_radius), height), (60, 50, 40), cv2.FILLED)
+    cv2.circle(frame, head_center, head_radius, (140, 170, 220), cv2.FILLED)
+
+
+def generate_video(video_path, width, height, fps, length_sec, slide_sec, seed=0):
+    # slides change at scripted frames, the presenter walks along the bottom part of the slide
+    # and leaves the frame from time to time; returns the frame intervals of every slide
+    random_state = np.random.RandomState(seed)
+    n_frames = int(length_sec * fps)
+    changes = []
+    frame_number = 0
+    while True:
+        frame_number += int(fps * slide_sec * random_state.uniform(0.5, 1.5))
+        if frame_number >= n_frames:
+            break
+        changes.append(frame_number)
+
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError('Can not write video "{}"'.format(video_path))
+
+    slide_ind = 0
+    slide = make_slide(width, height, seed)
+    for frame_number in range(n_frames):
+        if slide_ind < len(changes) and frame_number == changes[slide_ind]:
+            slide_ind += 1
+            slide = make_slide(width, height, seed + slide_ind)
+        frame = slide.copy()
+        t = frame_number / fps
+        if int(t // 15) % 4 != 3:
+            draw_presenter(frame, width * (0.5 + 0.4 * np.sin(t / 3)))
+        # sensor noise, otherwise static slides are compressed to nothing
+        frame = cv2.add(frame, random_state.randint(0, 3, frame.shape).astype(np.uint8))
+        writer.write(frame)
+    writer.release()
+
+    bounds = [0] + changes + [n_frames]
+    return [{'start': start, 'end': end - 1} for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+class ImageSaverNull(ImageSaverBase):
+    def save(self, image, position):
+        return '{}.png'.format(position)
+
+
+def run_recognizer(recognizer_name, video_path):
+    # runs in a fresh process, so that ru_maxrss is the peak of this recognizer only
+    recognizer_class, kwargs = {name: (cls, kwargs) for name, cls, kwargs in RECOGNIZERS}[recognizer_name]
+    cap = cv2.VideoCapture(video_path)
+    n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    stages = []
+    start = time.time()
+    vr = recognizer_class(video_path, ImageSaverNull(), **kwargs)
+    stages.append(('init', time.time() - start))
+
+    start = time.time()
+    keyframes = vr.get_keyframes()
+    stages.append(('get_keyframes', time.time() - start))
+    # stages inside get_keyframes, only recognizers with stage_stats report them
+    for name, stats in getattr(vr, 'stage_stats', {}).items():
+        stages.append(('get_keyframes.' + name, stats['wall_sec']))
+
+    start = time.time()
+    vr.save_keyframes(keyframes)
+    stages.append(('save_keyframes', time.time() - start))
+
+    return {
+        'keyframes': [int(keyframe) for keyframe in keyframes],
+        'stages': [{'name': name, 'sec': sec, 'fps': n_frames / sec if sec else None} for name, sec in stages],
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_benchmark(videos, recognizer_names):
+    results = []
+    for video in videos:
+        for recognizer_name in recognizer_names:
+            logger.info('%s on %s', recognizer_name, video['path'])
+            result = {'video': video['name'], 'recognizer_name': recognizer_name}
+            try:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+                    result.update(pool.submit(run_recognizer, recognizer_name, video['path']).result())
+                result['stats'] = get_stats(video['intervals'], result['keyframes'])
+            except Exception as e:
+                logger.exception('%s failed on %s', recognizer_name, video['path'])
+                result['error'] = repr(e)
+            results.append(result)
+    return results
+
+
+def print_results(results):
+    print('{:<24} {:<14} {:>16} {:>16} {:>10} {:>9} {:>9}'.format('video', 'engine', 'keyframes fps', 'save sec',
+                                                              'rss MB', 'precision', 'recall'))
+    for result in results:
+        if 'error' in result:
+            print('{:<24} {:<14} {}'.format(result['video'], result['recognizer_name'], result['error']))
+            continue
+        stages = {stage['name']: stage for stage in result['stages']}
+        print('{:<24} {:<14} {:>16.1f} {:>16.2f} {:>10.1f} {:>9.3f} {:>9.3f}'.format(
+            result['video'], result['recognizer_name'], stages['get_keyframes']['fps'] or 0,
+            stages['save_keyframes']['sec'], result['max_rss_mb'],
+            result['stats']['precision'], result['stats']['recall']))
+        for stage in result['stages']:
+            if stage['name'].startswith('get_keyframes.') and stage['fps'] is not None:
+                print('{:<24} {:<14} {:>16.1f}  {}'.format('', '', stage['fps'], stage['name']))
+
+
+def main():
+    args = parse_arguments()
+    videos_dir = args.videos_dir or tempfile.mkdtemp(prefix='synopsis-benchmark-')
+    if not os.path.exists(videos_dir):
+        os.makedirs(videos_dir)
+    try:
+        run(args, videos_dir)
+    finally:
+        if args.videos_dir is None:
+            shutil.rmtree(videos_dir, ignore_errors=True)
+
+
+def run(args, videos_dir):
+    videos = []
+    for resolution in args.resolutions:
+        width, height = map(int, resolution.split('x'))
+        for length_sec in args.lengths:
+            name = '{}x{}_{}s.mp4'.format(width, height, length_sec)
+            video_path = os.path.join(videos_dir, name)
+            logger.info('generating %s', video_path)
+            intervals = generate_video(video_path, width, height, args.fps, length_sec, args.slide_sec)
+            videos.append({'name': name, 'path': video_path, 'intervals': intervals})
+
+    results = run_benchmark(videos, args.recognizers)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
 import argparse
+import concurrent.futures
+import itertools
 import json
 import logging
 import os.path
@@ -13,13 +15,27 @@ import matplotlib.pyplot as plt
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from recognition.video.recognizers import VideoRecognitionNaive, VideoRecognitionPySceneDetect
-from recognition.video.image_uploaders import ImageSaverLocal
+from recognition.video.recognizers import (VideoRecognitionNaive, VideoRecognitionPySceneDetect, VideoRecognitionCells,
+                                           VideoRecognitionPackets)
+from recognition.video.image_uploaders import ImageSaverLocal, ImageFormat
 
 logging.basicConfig(format='[%(asctime)s]%(levelname)s:%(name)s:%(message)s')
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+RECOGNIZERS = [
+    ('naive', VideoRecognitionNaive),
+    ('pyscene', VideoRecognitionPySceneDetect),
+    ('packets', VideoRecognitionPackets),
+]
+
+# parameters which can be swept without extracting the features of a video again
+SWEEP_RECOGNIZERS = {
+    'naive': (VideoRecognitionNaive, ['threshold']),
+    'cells': (VideoRecognitionCells, ['cell_threshold_coef', 'peak_threshold', 'threshold_coef']),
+    'packets': (VideoRecognitionPackets, ['size_threshold_coef', 'max_frames_per_min']),
+}
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Synopsis creator')
 
@@ -40,7 +56,28 @@ def parse_arguments():
     save_keyframes_parser.add_argument('--no-save-keyframes', dest='save_keyframes', action='store_false')
     parser.set_defaults(save_keyframes=True)
 
+    parser.add_argument('--keyframes-format',
+                        help='Format of the saved keyframes.',
+                        choices=sorted(ImageFormat.extensions),
+                        default='png')
+
+    parser.add_argument('--keyframes-quality',
+                        help='Quality of jpeg and webp keyframes 0..100 or compression level of png ones 0..9.',
+                        type=int)
+
+    parser.add_argument('-j', '--jobs',
+                        help='Number of processes to run recognizers on the dataset.',
+                        type=int,
+                        default=1)
+
+    parser.add_argument('--sweep',
+                        help='Path to json with lists of threshold values by recognizer, e.g. '
+                             '{"naive": {"threshold": [0.3, 0.4]}, "cells": {"peak_threshold": [0.3, 0.4]}}. '
+                             'Every combination is evaluated on the dataset.')
+
     args = parser.parse_args()
+    if args.sweep and not args.dataset:
+        parser.error('--sweep requires --dataset')
 
     return args
 
@@ -50,30 +87,38 @@ def create_dirs_if_not_exist(dir_paths):
         if not os.path.exists(dir_path):
             os.makedirs(dir_path)
 
-def process_one_file(filepath, save_keyframes, output):
-    logger.info(filepath)
-    naive_image_saver = None
-    pyscene_image_saver = None
+def run_recognizer(recognizer_name, filepath, save_keyframes, output, image_format=None):
+    image_saver = None
     if save_keyframes:
-        naive_output_path = '{}/naive/{}.out'.format(output, os.path.basename(filepath))
-        pyscene_output_path = '{}/pyscene/{}.out'.format(output, os.path.basename(filepath))
-        create_dirs_if_not_exist([naive_output_path, pyscene_output_path])
-        naive_image_saver = ImageSaverLocal(naive_output_path)
-        pyscene_image_saver = ImageSaverLocal(pyscene_output_path)
+        output_path = '{}/{}/{}.out'.format(output, recognizer_name, os.path.basename(filepath))
+        create_dirs_if_not_exist([output_path])
+        image_saver = ImageSaverLocal(output_path, image_format)
 
-    vr_naive = VideoRecognitionNaive(filepath, naive_image_saver)
-    vr_pyscene = VideoRecognitionPySceneDetect(filepath, pyscene_image_saver)
+    vr = dict(RECOGNIZERS)[recognizer_name](filepath, image_saver)
 
-    logger.info('start vr_naive')
-    naive_keyframes = vr_naive.get_keyframes()
-    logger.info('start vr_pyscene')
-    pyscene_keyframes = vr_pyscene.get_keyframes()
+    logger.info('start vr_{} on {}'.format(recognizer_name, filepath))
+    keyframes = vr.get_keyframes()
 
     if save_keyframes:
-        vr_naive.save_keyframes(naive_keyframes)
-        vr_pyscene.save_keyframes(pyscene_keyframes)
+        vr.save_keyframes(keyframes)
+
+    return keyframes
+
+def process_one_file(filepath, save_keyframes, output, image_format=None):
+    logger.info(filepath)
+    return tuple(run_recognizer(recognizer_name, filepath, save_keyframes, output, image_format)
+                 for recognizer_name, _ in RECOGNIZERS)
+
+def process_files(filepaths, save_keyframes, output, jobs=1, image_format=None):
+    # keyframes of every recognizer for every file, in the order of filepaths and RECOGNIZERS
+    if jobs <= 1:
+        return [process_one_file(filepath, save_keyframes, output, image_format) for filepath in filepaths]
 
-    return naive_keyframes, pyscene_keyframes
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [[pool.submit(run_recognizer, recognizer_name, filepath, save_keyframes, output, image_format)
+                    for recognizer_name, _ in RECOGNIZERS]
+                   for filepath in filepaths]
+        return [tuple(future.result() for future in file_futures) for file_futures in futures]
 
 def get_stats(true_intervals, results):
     tps = []
@@ -99,7 +144,7 @@ def plot_results(results, output):
     n_recognizers = len(results[0]['stats_by_recognizers'])
     ind = [1, 2, 3, 4]
     tick_label = ['precision', 'recall', 'n_missing', 'n_extra']
-    f, axarr = plt.subplots(n_recognizers, n_videos, figsize=(20, 10))
+    f, axarr = plt.subplots(n_recognizers, n_videos, figsize=(20, 10), squeeze=False)
     for i, result in enumerate(results):
         max_n = max(list(map(lambda item: max(item['stats']['n_missing'], item['stats']['n_extra']),
                              result['stats_by_recognizers'])))
@@ -123,11 +168,80 @@ def plot_results(results, output):
     plt.tight_layout()
     plt.savefig('{}/result.png'.format(output))
 
+def get_sweep_combinations(grid):
+    combinations = {}
+    for recognizer_name, params in grid.items():
+        if recognizer_name not in SWEEP_RECOGNIZERS:
+            raise ValueError('Unknown recognizer "{}" in sweep'.format(recognizer_name))
+        unknown_params = set(params) - set(SWEEP_RECOGNIZERS[recognizer_name][1])
+        if unknown_params:
+            raise ValueError('Parameters {} of "{}" can not be swept'.format(sorted(unknown_params), recognizer_name))
+        names = sorted(params)
+        combinations[recognizer_name] = [dict(zip(names, values))
+                                         for values in itertools.product(*(params[name] for name in names))]
+    return combinations
+
+
+def sweep(dataset_path, grid_path, output):
+    with open(grid_path, 'r') as f:
+        combinations = get_sweep_combinations(json.load(f))
+    with open('{}/data.json'.format(dataset_path), 'r') as f:
+        data = json.load(f)
+
+    stats_by_combination = {(recognizer_name, i): []
+                            for recognizer_name, params_list in combinations.items()
+                            for i in range(len(params_list))}
+    for video in data['videos']:
+        video_path = '{}/{}'.format(dataset_path, video['name'])
+        logger.info(video_path)
+        for recognizer_name, params_list in combinations.items():
+            # the first get_keyframes extracts the features, the next ones only apply new thresholds
+            recognizer = SWEEP_RECOGNIZERS[recognizer_name][0](video_path)
+            for i, params in enumerate(params_list):
+                for name, value in params.items():
+                    setattr(recognizer, name, value)
+                keyframes = recognizer.get_keyframes()
+                stats_by_combination[recognizer_name, i].append(get_stats(video['intervals'], keyframes))
+
+    rows = []
+    for (recognizer_name, i), stats in stats_by_combination.items():
+        precision = sum(item['precision'] for item in stats) / len(stats) if stats else 0
+        recall = sum(item['recall'] for item in stats) / len(stats) if stats else 0
+        rows.append({
+            'recognizer_name': recognizer_name,
+            'params': combinations[recognizer_name][i],
+            'precision': precision,
+            'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0,
+            'n_missing': sum(item['n_missing'] for item in stats),
+            'n_extra': sum(item['n_extra'] for item in stats),
+        })
+    rows.sort(key=lambda row: (-row['f1'], -row['recall'], -row['precision']))
+
+    create_dirs_if_not_exist([output])
+    with open('{}/sweep.json'.format(output), 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    print('{:<6} {:>9} {:>9} {:>9} {:>9} {:>9}  {}'.format('rank', 'f1', 'precision', 'recall',
+                                                            'n_missing', 'n_extra', 'params'))
+    for rank, row in enumerate(rows, 1):
+        print('{:<6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9} {:>9}  {} {}'.format(rank, row['f1'], row['precision'],
+                                                                         row['recall'], row['n_missing'],
+                                                                         row['n_extra'], row['recognizer_name'],
+                                                                         json.dumps(row['params'], sort_keys=True)))
+    return rows
+
+
 def main():
     args = parse_arguments()
 
+    if args.sweep:
+        sweep(args.dataset, args.sweep, args.output)
+        return
+
+    image_format = ImageFormat.from_quality(args.keyframes_format, args.keyframes_quality)
     if args.file:
-        process_one_file(args.file, args.save_keyframes, args.output)
+        process_one_file(args.file, args.save_keyframes, args.output, image_format)
         return
 
     if args.dataset:
@@ -136,34 +250,31 @@ def main():
         with open(data_path, 'r') as f:
             data = json.load(f)
 
-        results = []
-        for video in data['videos']:
-            video_path = '{}/{}'.format(dataset_path, video['name'])
+        video_paths = ['{}/{}'.format(dataset_path, video['name']) for video in data['videos']]
+        keyframes_by_videos = process_files(video_paths, args.save_keyframes, args.output, args.jobs, image_format)
 
-            naive_keyframes, pyscene_keyframes = process_one_file(video_path, args.save_keyframes, args.output)
-            naive_stats = get_stats(video['intervals'], naive_keyframes)
-            pyscene_stats = get_stats(video['intervals'], pyscene_keyframes)
+        results = []
+        for video, keyframes_by_recognizers in zip(data['videos'], keyframes_by_videos):
             results.append(
                 {
                     'name': video['name'],
                     'intervals': video['intervals'],
                     'stats_by_recognizers': [
                         {
-                            'recognizer_name': 'naive',
-                            'keyframes': naive_keyframes,
-                            'stats': naive_stats
-                        },
-                        {
-                            'recognizer_name': 'pyscene',
-                            'keyframes': pyscene_keyframes,
-                            'stats': pyscene_stats
+                            'recognizer_name': recognizer_name,
+                            'keyframes': keyframes,
+                            'stats': get_stats(video['intervals'], keyframes)
                         }
+                        for (recognizer_name, _), keyframes in zip(RECOGNIZERS, keyframes_by_recognizers)
                     ]
                 })
         logger.info(results)
 
+        create_dirs_if_not_exist([args.output])
         with open('{}/result.json'.format(args.output), 'w') as f:
             json.dump(results, f)
+        if results:
+            plot_results(results, args.output)
 
 if __name__ == '__main__':
     main()
@@ -11,12 +11,13 @@ from .constants import ContentType
 def get_session_with_retries(number_of_retries: int = 5,
                              backoff_factor: float = 0.2,
                              status_forcelist: Iterable[int] = {500, 502, 503, 504},
-                             prefix: str = 'https://') -> requests.Session:
+                             prefix: str = 'https://',
+                             pool_maxsize: int = requests.adapters.DEFAULT_POOLSIZE) -> requests.Session:
     session = requests.session()
     retries = Retry(total=number_of_retries,
                     backoff_factor=backoff_factor,
                     status_forcelist=status_forcelist)
-    session.mount(prefix, HTTPAdapter(max_retries=retries))
+    session.mount(prefix, HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize))
     return session
 
 
@@ -31,14 +32,18 @@ def merge_audio_and_video(keyframes: List[list],
     for keyframe in keyframes:
         last_time, keyframe[1] = keyframe[1], last_time
 
+    def append_image(src):
+        # a reused image right after itself is shown once
+        image = {
+            'type': ContentType.IMG,
+            'content': src
+        }
+        if len(content) == 0 or content[-1] != image:
+            content.append(image)
+
     while frames_ptr < len(keyframes) and audio_ptr < len(recognized_audio):
         if keyframes[frames_ptr][1] <= recognized_audio[audio_ptr].start:
-            content.append(
-                {
-                    'type': ContentType.IMG,
-                    'content': keyframes[frames_ptr][0]
-                }
-            )
+            append_image(keyframes[frames_ptr][0])
             frames_ptr += 1
         else:
             content.append(
@@ -50,12 +55,7 @@ def merge_audio_and_video(keyframes: List[list],
             audio_ptr += 1
 
     while frames_ptr < len(keyframes):
-        content.append(
-            {
-                'type': ContentType.IMG,
-                'content': keyframes[frames_ptr][0]
-            }
-        )
+        append_image(keyframes[frames_ptr][0])
         frames_ptr += 1
 
     while audio_ptr < len(recognized_audio):
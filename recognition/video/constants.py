@@ -1,3 +1,5 @@
+import os
+
 FRAME_PERIOD = 3
 BOTTOM_LINE_COEF = 3
 
@@ -9,8 +11,28 @@ MAX_KEYFRAME_PER_SEC = MAX_KEYFRAME_PER_MIN / 60
 
 SCALE_FACTOR = 1.05
 MIN_SIZE_COEF = 5
+HUMAN_DETECTION_SCALE = 0.5
+HAAR_CASCADE_PATH = os.path.join(os.path.dirname(__file__), 'static', 'HS.xml')
 
 CENTER_LEFT_BORDER = 0.4
 CENTER_RIGHT_BORDER = 0.6
 
+MIN_SEEK_DISTANCE_SEC = 2
+
+COARSE_LOCAL_DIFF_COEF = 3
+
+# the frames kept in memory for the peaks and the segment borders, about 64 frames of 960x540
+MAX_BUFFERED_BYTES = 32 * 1024 * 1024
+
+PACKET_SIZE_THRESHOLD_COEF = 3
+PACKET_WINDOW_SEC = 2
+
+ENCODE_THREADS = 4
+
+IMAGE_HASH_SIZE = (32, 18)
+IMAGE_HASH_MAX_DIFF = 8
+
 UPLOADCARE_URL_TO_UPLOAD = 'https://upload.uploadcare.com/base/'
+UPLOAD_THREADS = 8
+UPLOAD_RETRIES = 3
+UPLOAD_BACKOFF_SEC = 0.5
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .types import ScanResult
+from .utils import RectangleArray
+
+
+# keeps the results of VideoRecognitionCells._scan_video on disk, one compressed .npz file per video and
+# extraction parameters, so that tuning of the thresholds does not decode the video again
+class FeatureStore(object):
+    def __init__(self, store_dir: str, hash_chunk_size: int = 1 << 20):
+        self.store_dir = store_dir
+        self.hash_chunk_size = hash_chunk_size
+        self._video_hashes = {}
+        os.makedirs(store_dir, exist_ok=True)
+
+    def load(self, video_file_path: str, params: dict) -> ScanResult:
+        file_path = self._get_file_path(video_file_path, params)
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as features:
+            return ScanResult(humans=RectangleArray(*features['humans'].reshape((-1, 4)).T),
+                              cells_diffs=features['cells_diffs'],
+                              frame_positions=features['frame_positions'],
+                              is_measured=features['is_measured'])
+
+    def save(self, video_file_path: str, params: dict, scan_result: ScanResult):
+        file_path = self._get_file_path(video_file_path, params)
+        humans = RectangleArray.from_rectangles(scan_result.humans).to_array()
+        # written under a temporary name first, a half-written file is never loaded
+        tmp_file_path = file_path + '.tmp.npz'
+        np.savez_compressed(tmp_file_path,
+                            humans=humans,
+                            cells_diffs=scan_result.cells_diffs,
+                            frame_positions=scan_result.frame_positions,
+                            is_measured=scan_result.is_measured)
+        os.replace(tmp_file_path, file_path)
+
+    def get_video_hash(self, video_file_path: str) -> str:
+        stat = os.stat(video_file_path)
+        key = (os.path.abspath(video_file_path), stat.st_size, stat.st_mtime)
+        if key not in self._video_hashes:
+            sha1 = hashlib.sha1()
+            with open(video_file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.hash_chunk_size), b''):
+                    sha1.update(chunk)
+            self._video_hashes[key] = sha1.hexdigest()
+        return self._video_hashes[key]
+
+    def _get_file_path(self, video_file_path: str, params: dict) -> str:
+        params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.store_dir, '{}_{}.npz'.format(self.get_video_hash(video_file_path),
+                                                                params_hash[:16]))
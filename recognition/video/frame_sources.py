@@ -0,0 +1,247 @@
+import logging
+import subprocess
+
+import cv2
+import numpy as np
+
+from exceptions import CreateSynopsisError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def seek_capture(cap, frame_position: int):
+    # OpenCV seeks to the closest previous keyframe and decodes up to the position, the position reported
+    # after decoding tells whether it got there; the frame at the position or None if it did not
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_position)
+    ret, frame = cap.read()
+    if not ret or int(round(cap.get(cv2.CAP_PROP_POS_FRAMES))) != frame_position + 1:
+        return None
+    return frame
+
+
+# frames are sampled either every `frame_period` frames or, if `frame_period_ms` is set, by time:
+# the sampled frame number k is the first frame with timestamp >= (k + 1) * frame_period_ms - 1000 / fps,
+# which is the frame (k + 1) * frame_period - 1 for a constant frame rate
+# and frame_period_ms = frame_period * 1000 / fps
+class FrameSourceBase(object):
+    def __init__(self, video_file_path: str, frame_period: int = 1, resize_coef: float = 1,
+                 frame_period_ms: float = None):
+        self.video_file_path = video_file_path
+        self.frame_period = frame_period
+        self.frame_period_ms = frame_period_ms
+        self.resize_coef = resize_coef
+
+        # noinspection PyArgumentList
+        cap = cv2.VideoCapture(video_file_path)
+        if not cap.isOpened():
+            raise CreateSynopsisError('FrameSource error, wrong video filename "{filename}"'
+                                      .format(filename=video_file_path))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.video_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.video_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+
+        # the same size as cv2.resize with fx = fy = resize_coef gives
+        self.width = int(round(self.video_width * resize_coef))
+        self.height = int(round(self.video_height * resize_coef))
+
+        # the number of the next sampled frame and the position in the video of the last read one
+        self.frame_number = 0
+        self.position = -1
+
+    # frame_number is a number of a sampled frame
+    def seek(self, frame_number: int):
+        raise NotImplementedError()
+
+    # whether seek gets to the frame without decoding the video from the start
+    def can_seek(self, frame_number: int) -> bool:
+        return True
+
+    # the next sampled frame in grayscale with the size (height, width) or None at the end of the video
+    def read(self):
+        raise NotImplementedError()
+
+    # passes the next sampled frame without converting it, False at the end of the video
+    def skip(self) -> bool:
+        return self.read() is not None
+
+    # frees the decoder, the next seek opens it again
+    def release(self):
+        pass
+
+    def get_sample_time_ms(self, frame_number: int) -> float:
+        return (frame_number + 1) * self.frame_period_ms - 1000 / self.fps
+
+    def get_sample_position(self, frame_number: int) -> int:
+        # the video frame of the sampled frame for a constant frame rate
+        if self.frame_period_ms is None:
+            return (frame_number + 1) * self.frame_period - 1
+        return int(np.ceil(self.get_sample_time_ms(frame_number) * self.fps / 1000 - 1e-6))
+
+    def __iter__(self):
+        frame = self.read()
+        while frame is not None:
+            yield frame
+            frame = self.read()
+
+
+# skipped frames are only grabbed, decoding and colour conversion are done for the sampled frames;
+# if seeking in the container lands on a wrong frame, the frames are grabbed from the start instead
+class FrameSourceOpenCV(FrameSourceBase):
+    def __init__(self, video_file_path: str, frame_period: int = 1, resize_coef: float = 1,
+                 frame_period_ms: float = None):
+        super().__init__(video_file_path, frame_period, resize_coef, frame_period_ms)
+        # noinspection PyArgumentList
+        self.cap = cv2.VideoCapture(video_file_path)
+        self.seek_is_reliable = True
+
+    def seek(self, frame_number: int):
+        if not self.cap.isOpened():
+            self.cap.open(self.video_file_path)
+            self.position = -1
+        self.frame_number = frame_number
+        # the last frame before the sampled one
+        position = self.get_sample_position(frame_number - 1) if frame_number != 0 else -1
+        if position >= 0 and self.seek_is_reliable:
+            if seek_capture(self.cap, position) is not None:
+                self.position = position
+                return
+            logger.warning('seeking is unreliable for "%s", grabbing frames from the start', self.video_file_path)
+            self.seek_is_reliable = False
+            self.position = None
+
+        if self.position is None or position < self.position:
+            self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
+            self.position = -1
+        while self.position < position and self.cap.grab():
+            self.position += 1
+
+    def can_seek(self, frame_number: int) -> bool:
+        if frame_number == 0:
+            return True
+        if not self.seek_is_reliable:
+            return False
+        is_exact = seek_capture(self.cap, self.get_sample_position(frame_number - 1)) is not None
+        # the capture is at the checked frame, the current sampled frame is sought again
+        self.seek(self.frame_number)
+        return is_exact
+
+    def read(self):
+        if not self._grab_sample():
+            return None
+        ret, frame = self.cap.retrieve()
+        if not ret:
+            return None
+        self.frame_number += 1
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.resize_coef != 1:
+            frame = cv2.resize(frame, (0, 0), fx=self.resize_coef, fy=self.resize_coef)
+        return frame
+
+    def skip(self) -> bool:
+        if not self._grab_sample():
+            return False
+        self.frame_number += 1
+        return True
+
+    def release(self):
+        self.cap.release()
+
+    def _grab_sample(self) -> bool:
+        if self.frame_period_ms is None:
+            for i in range(self.frame_period):
+                if not self.cap.grab():
+                    return False
+                self.position += 1
+        else:
+            # a quarter of a frame for timestamps rounded to milliseconds
+            sample_time_ms = self.get_sample_time_ms(self.frame_number) - 250 / self.fps
+            while True:
+                if not self.cap.grab():
+                    return False
+                self.position += 1
+                if self.cap.get(cv2.CAP_PROP_POS_MSEC) >= sample_time_ms:
+                    break
+        return True
+
+
+# frames are decoded, sampled, scaled and converted to grayscale by an ffmpeg subprocess,
+# every frame is read from its stdout straight into the memory of a numpy array
+class FrameSourceFFmpeg(FrameSourceBase):
+    def __init__(self, video_file_path: str, frame_period: int = 1, resize_coef: float = 1,
+                 frame_period_ms: float = None, ffmpeg_binary: str = 'ffmpeg'):
+        super().__init__(video_file_path, frame_period, resize_coef, frame_period_ms)
+        self.ffmpeg_binary = ffmpeg_binary
+        # the subprocess is started by the first seek or read
+        self.process = None
+        # skipped frames are read from the pipe into the same array
+        self._skipped_frame = None
+
+    def seek(self, frame_number: int):
+        self.release()
+        self.frame_number = frame_number
+        self.position = self.get_sample_position(frame_number - 1) if frame_number != 0 else -1
+
+        command = [self.ffmpeg_binary, '-loglevel', 'quiet', '-nostdin']
+        if self.frame_period_ms is None:
+            # n is counted from the first frame after the previous sampled one
+            if frame_number != 0:
+                command += ['-ss', '{:.6f}'.format((self.position + 0.5) / self.fps)]
+            select = 'not(mod(n+1,{}))'.format(self.frame_period)
+        else:
+            # the first frame after every sample time, the decoding starts from the previous sampled frame
+            # which is never selected itself, timestamps are kept by -copyts after seeking
+            if frame_number != 0:
+                command += ['-ss', '{:.6f}'.format(max(0, self.position - 0.5) / self.fps), '-copyts']
+            offset_ms = self.frame_period_ms - 1000 / self.fps - 250 / self.fps
+            select = 'gt(floor((t*1000-{offset})/{period}),floor((prev_t*1000-{offset})/{period}))' \
+                .format(offset=offset_ms, period=self.frame_period_ms)
+            if frame_number == 0:
+                # prev_t is not defined for the first frame of the video
+                select += '+isnan(prev_t)*gte(t*1000,{})'.format(offset_ms + self.frame_period_ms)
+
+        video_filter = "select='{select}',scale={width}:{height}".format(select=select,
+                                                                       width=self.width,
+                                                                       height=self.height)
+        command += ['-i', self.video_file_path,
+                    '-an', '-vf', video_filter, '-vsync', '0',
+                    '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1']
+        try:
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                            bufsize=self.width * self.height)
+        except OSError as e:
+            raise CreateSynopsisError('FrameSource error, cant run ffmpeg: {}'.format(e))
+
+    def read(self):
+        frame = np.empty((self.height, self.width), dtype=np.uint8)
+        if not self._read_into(frame):
+            return None
+        return frame
+
+    def skip(self) -> bool:
+        if self._skipped_frame is None:
+            self._skipped_frame = np.empty((self.height, self.width), dtype=np.uint8)
+        return self._read_into(self._skipped_frame)
+
+    def _read_into(self, frame) -> bool:
+        if self.process is None:
+            self.seek(self.frame_number)
+        buffer = memoryview(frame).cast('B')
+        n_read = 0
+        while n_read < len(buffer):
+            n = self.process.stdout.readinto(buffer[n_read:])
+            if not n:
+                return False
+            n_read += n
+        self.position = self.get_sample_position(self.frame_number)
+        self.frame_number += 1
+        return True
+
+    def release(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.kill()
+            self.process.wait()
+            self.process = None
@@ -1,45 +1,167 @@
-import io
+import concurrent.futures
+import logging
+import time
+from typing import Iterable, List, Tuple
+
+import cv2
+import numpy as np
+from requests import RequestException
 
 from exceptions import CreateSynopsisError
-from .constants import UPLOADCARE_URL_TO_UPLOAD
+from .constants import (UPLOADCARE_URL_TO_UPLOAD, IMAGE_HASH_MAX_DIFF, UPLOAD_THREADS, UPLOAD_RETRIES,
+                        UPLOAD_BACKOFF_SEC)
 from ..utils import get_session_with_retries
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# the format of the saved keyframes: png with a compression level 0..9, jpeg or webp with a quality 0..100,
+# the defaults of OpenCV are used for None
+class ImageFormat(object):
+    extensions = {'png': '.png', 'jpeg': '.jpg', 'webp': '.webp'}
+
+    def __init__(self, name: str = 'png', quality: int = None, png_compression: int = None):
+        if name not in self.extensions:
+            raise CreateSynopsisError('Unknown image format "{}"'.format(name))
+        self.name = name
+        self.extension = self.extensions[name]
+        self.mime_type = 'image/{}'.format(name)
+        self.params = []
+        if name == 'png' and png_compression is not None:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif name == 'jpeg' and quality is not None:
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif name == 'webp' and quality is not None:
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+    @staticmethod
+    def from_quality(name: str = 'png', quality: int = None) -> 'ImageFormat':
+        # the single quality option of the settings and of the command line, 0..100 for jpeg and webp
+        # or the compression level 0..9 for png
+        if name == 'png':
+            return ImageFormat(name, png_compression=quality)
+        return ImageFormat(name, quality=quality)
+
+    def encode(self, image) -> memoryview:
+        # the encoded bytes are the memory of the array of cv2.imencode, nothing is copied
+        ret, buffer = cv2.imencode(self.extension, image, self.params)
+        if not ret:
+            raise CreateSynopsisError('Failed to encode image as {}'.format(self.name))
+        return memoryview(buffer.reshape(-1))
+
+
+# sources of the saved keyframes by their image hashes (see get_image_hash), one instance is shared by
+# the videos of a lesson, so that a slide shown in several steps is encoded and saved once
+class SavedImages(object):
+    def __init__(self, max_diff: int = IMAGE_HASH_MAX_DIFF):
+        self.max_diff = max_diff
+        self.hashes = []
+        self.srcs = []
+
+    def is_same(self, lhs_hash: np.ndarray, rhs_hash: np.ndarray) -> bool:
+        return lhs_hash.shape == rhs_hash.shape and int(cv2.absdiff(lhs_hash, rhs_hash).max()) <= self.max_diff
+
+    def find(self, image_hash: np.ndarray) -> str:
+        for saved_hash, src in zip(self.hashes, self.srcs):
+            if self.is_same(image_hash, saved_hash):
+                return src
+        return None
+
+    def add(self, image_hash: np.ndarray, src: str):
+        self.hashes.append(image_hash)
+        self.srcs.append(src)
+
 
 class ImageSaverBase(object):
-    def save(self, image: io.BytesIO, position: int) -> str:
+    def __init__(self, image_format: ImageFormat = None):
+        self.image_format = image_format or ImageFormat()
+
+    def save(self, image: memoryview, position: int) -> str:
+        # image is the encoded file in self.image_format, any bytes-like object
         raise NotImplementedError()
 
+    def submit(self, image: memoryview, position: int) -> concurrent.futures.Future:
+        # the future of the src of the saved image, savers with slow saving override it to save in background
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(self.save(image, position))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def save_many(self, images: Iterable[Tuple[memoryview, int]]) -> List[str]:
+        # the srcs of (image, position) pairs in their order
+        futures = [self.submit(image, position) for image, position in images]
+        return [future.result() for future in futures]
+
+    def close(self):
+        pass
+
 
 class ImageSaverUploadcare(ImageSaverBase):
-    def __init__(self, pub_key):
-        super().__init__()
-        self.session = get_session_with_retries()
+    # images are uploaded on a pool of n_threads threads sharing the keep-alive connections of one session,
+    # an image is uploaded again up to number_of_retries times on a connection error or a 5xx response
+    def __init__(self, pub_key, image_format: ImageFormat = None, url_to_upload: str = UPLOADCARE_URL_TO_UPLOAD,
+                 n_threads: int = UPLOAD_THREADS, number_of_retries: int = UPLOAD_RETRIES,
+                 backoff_sec: float = UPLOAD_BACKOFF_SEC):
+        super().__init__(image_format)
+        self.url_to_upload = url_to_upload
+        # the retries are made by _upload only, the ones of the session would multiply them
+        self.session = get_session_with_retries(number_of_retries=0, prefix=url_to_upload,
+                                                pool_maxsize=max(1, n_threads))
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, n_threads))
         self.pub_key = pub_key
+        self.number_of_retries = number_of_retries
+        self.backoff_sec = backoff_sec
+
+    def save(self, image: memoryview, position: int) -> str:
+        return self.submit(image, position).result()
+
+    def submit(self, image: memoryview, position: int) -> concurrent.futures.Future:
+        return self.pool.submit(self._upload, image, position)
+
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
 
-    def save(self, image: io.BytesIO, position: int) -> str:
+    def _upload(self, image: memoryview, position: int) -> str:
         data = {
             'UPLOADCARE_PUB_KEY': self.pub_key,
             'UPLOADCARE_STORE': 1
         }
 
-        response = self.session.post(url=UPLOADCARE_URL_TO_UPLOAD,
-                                     files={'file': image},
-                                     data=data)
+        for attempt in range(self.number_of_retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff_sec * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(url=self.url_to_upload,
+                                             files={'file': ('{}{}'.format(position, self.image_format.extension),
+                                                             image, self.image_format.mime_type)},
+                                             data=data)
+            except RequestException as e:
+                error = 'Failed to upload image {}: {}'.format(position, e)
+                logger.warning(error)
+                continue
 
-        if not response:
-            raise CreateSynopsisError('Failed to upload image, status code: {status_code}'
-                                      .format(status_code=response.status_code))
+            if response:
+                return 'https://ucarecdn.com/{uuid}/'.format(uuid=response.json()['file'])
+            error = 'Failed to upload image {}, status code: {status_code}'.format(
+                position, status_code=response.status_code)
+            logger.warning(error)
+            if response.status_code < 500:
+                break
 
-        return 'https://ucarecdn.com/{uuid}/'.format(uuid=response.json()['file'])
+        raise CreateSynopsisError(error)
 
 
 class ImageSaverLocal(ImageSaverBase):
-    def __init__(self, base_path):
-        super().__init__()
+    def __init__(self, base_path, image_format: ImageFormat = None):
+        super().__init__(image_format)
         self.base_path = base_path
 
-    def save(self, image: io.BytesIO, position: int) -> str:
-        filename = '{}/{}.png'.format(self.base_path, position)
+    def save(self, image: memoryview, position: int) -> str:
+        filename = '{}/{}{}'.format(self.base_path, position, self.image_format.extension)
         with open(filename, 'wb') as file:
-            file.write(image.getvalue())
+            file.write(image)
         return filename
@@ -0,0 +1,27 @@
+import json
+import subprocess
+
+import numpy as np
+
+from exceptions import CreateSynopsisError
+from .types import Packets
+
+
+# sizes and key flags of the packets of the first video stream, ffprobe reads them from the container
+# without decoding a single frame; packets are stored in decoding order and sorted by their timestamps
+def read_packets(video_file_path: str, ffprobe_binary: str = 'ffprobe') -> Packets:
+    command = [ffprobe_binary, '-loglevel', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts,dts,size,flags', '-of', 'json', video_file_path]
+    try:
+        output = subprocess.check_output(command, stdin=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise CreateSynopsisError('Packets error, cant run ffprobe: {}'.format(e))
+
+    packets = json.loads(output.decode()).get('packets', [])
+    # pts is missing for the packets of some containers, dts is in the same order for them
+    timestamps = np.array([int(packet.get('pts', packet.get('dts', i))) for i, packet in enumerate(packets)],
+                          dtype=np.int64)
+    order = np.argsort(timestamps, kind='mergesort')
+    sizes = np.array([int(packet['size']) for packet in packets], dtype=np.int64)[order]
+    is_key = np.array(['K' in packet.get('flags', '') for packet in packets], dtype=bool)[order]
+    return Packets(sizes=sizes, is_key=is_key)
@@ -1,19 +1,32 @@
-import io
+import concurrent.futures
+import json
+import resource
+import time
+import tracemalloc
+from collections import OrderedDict, deque
 from enum import Enum
-from typing import Iterable, List
+from typing import Dict, Iterable, List
 
 import cv2
 import logging
 import numpy as np
 import peakutils
 import scenedetect
+from scipy.ndimage import median_filter
 
 from exceptions import CreateSynopsisError
-from .utils import Rectangle, image_diff_abs, get_rectangle_with_human_dlib
+from .utils import (RectangleArray, FrameBuffer, FrameCache, CellsGrid, HumanTracker, image_diff_abs,
+                    get_rectangle_with_human_dlib, get_haar_cascade, get_image_hash)
 from .constants import (TIME_BETWEEN_KEYFRAMES, FRAME_PERIOD, BOTTOM_LINE_COEF, SCALE_FACTOR, MIN_SIZE_COEF,
                         THRESHOLD_FOR_PEAKS_DETECTION, MAX_KEYFRAME_PER_SEC, THRESHOLD_DELTA, CENTER_LEFT_BORDER,
-                        CENTER_RIGHT_BORDER)
-from .image_uploaders import ImageSaverBase
+                        CENTER_RIGHT_BORDER, MIN_SEEK_DISTANCE_SEC, HUMAN_DETECTION_SCALE, HAAR_CASCADE_PATH,
+                        MAX_KEYFRAME_PER_MIN, PACKET_SIZE_THRESHOLD_COEF, PACKET_WINDOW_SEC, ENCODE_THREADS,
+                        COARSE_LOCAL_DIFF_COEF, MAX_BUFFERED_BYTES)
+from .feature_store import FeatureStore
+from .frame_sources import FrameSourceOpenCV, seek_capture
+from .image_uploaders import ImageSaverBase, SavedImages
+from .packets import read_packets
+from .types import ScanResult
 
 logging.basicConfig(format='[%(asctime)s]%(levelname)s:%(name)s:%(message)s')
 logger = logging.getLogger(__name__)
@@ -23,6 +36,7 @@ logger.setLevel(logging.DEBUG)
 class VideoRecognitionBase(object):
     def __init__(self, video_file_path: str, image_saver: ImageSaverBase = None):
         self.image_saver = image_saver
+        self.video_file_path = video_file_path
         # noinspection PyArgumentList
         self.cap = cv2.VideoCapture(video_file_path)
         self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
@@ -31,33 +45,102 @@ class VideoRecognitionBase(object):
             raise CreateSynopsisError('VideoRecognition error, wrong video filename "{filename}"'
                                       .format(filename=video_file_path))
 
-    def get_keyframes_src_with_timestamp(self) -> List[list]:
+    def get_keyframes_src_with_timestamp(self, saved_images: SavedImages = None) -> List[list]:
         keyframe_positions = self.get_keyframes()
-        keyframes_src_with_timestamp = self.save_keyframes(keyframe_positions)
+        keyframes_src_with_timestamp = self.save_keyframes(keyframe_positions, saved_images=saved_images)
         return keyframes_src_with_timestamp
 
     def get_keyframes(self) -> List[int]:
         raise NotImplementedError()
 
-    def save_keyframes(self, keyframe_positions: Iterable[int]) -> List[list]:
-        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
-
-        frame_ptr = 0
-        _, frame = self.cap.read()
+    def save_keyframes(self, keyframe_positions: Iterable[int], n_threads: int = ENCODE_THREADS,
+                       saved_images: SavedImages = None) -> List[list]:
+        # frames are encoded on a thread pool while the next ones are decoded, OpenCV releases the GIL
+        # in both; the encoded images are saved in the order of their positions.
+        # Of the neighbouring keyframes with the same image hash only the last one is kept, its timestamp
+        # is the end of the slide; the image of an earlier keyframe or of saved_images is reused for the others
         keyframe_positions = sorted(keyframe_positions)
-        keyframes_src_with_timestamp = []
-        for keyframe_position in keyframe_positions:
-            while self.cap.isOpened() and frame_ptr != keyframe_position:
-                ret, frame = self.cap.read()
-                frame_ptr += 1
-                if not ret:
-                    raise CreateSynopsisError('Wrong keyframe_position = {}'.format(keyframe_position))
-
-            image_bytes = io.BytesIO(cv2.imencode('.png', frame)[1].tostring())
-            image_src = self.image_saver.save(image_bytes, keyframe_position)
-            keyframes_src_with_timestamp.append([image_src, keyframe_position / self.fps])
+        if saved_images is None:
+            saved_images = SavedImages()
+        image_format = self.image_saver.image_format
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, n_threads)) as pool:
+            # the position, the image hash and the future of the encoded image, the src of a saved image
+            # or the index of an earlier keyframe of the video
+            keyframes = []
+
+            def add_keyframe(keyframe_position, frame, image_hash):
+                for i, (_, earlier_hash, _) in enumerate(keyframes):
+                    if saved_images.is_same(image_hash, earlier_hash):
+                        keyframes.append((keyframe_position, image_hash, i))
+                        return
+                image_src = saved_images.find(image_hash)
+                if image_src is None:
+                    image_src = pool.submit(image_format.encode, frame)
+                keyframes.append((keyframe_position, image_hash, image_src))
+
+            # a run is compared with its first hash, so that a slow drift of the image starts a new one
+            last_keyframe = None
+            run_hash = None
+            for keyframe_position, frame in zip(keyframe_positions, self._read_frames(keyframe_positions)):
+                image_hash = get_image_hash(frame)
+                if run_hash is None or not saved_images.is_same(image_hash, run_hash):
+                    if last_keyframe is not None:
+                        add_keyframe(*last_keyframe)
+                    run_hash = image_hash
+                last_keyframe = (keyframe_position, frame, image_hash)
+            if last_keyframe is not None:
+                add_keyframe(*last_keyframe)
+
+            # the encoded images are handed to the saver as soon as they are ready, the srcs are waited for
+            # only after all of them are submitted
+            keyframes = [(keyframe_position, image_hash,
+                          self.image_saver.submit(image_src.result(), keyframe_position)
+                          if isinstance(image_src, concurrent.futures.Future) else image_src)
+                         for keyframe_position, image_hash, image_src in keyframes]
+
+            keyframes_src_with_timestamp = []
+            n_saved = 0
+            for keyframe_position, image_hash, image_src in keyframes:
+                if isinstance(image_src, concurrent.futures.Future):
+                    image_src = image_src.result()
+                    saved_images.add(image_hash, image_src)
+                    n_saved += 1
+                elif isinstance(image_src, int):
+                    image_src = keyframes_src_with_timestamp[image_src][0]
+                keyframes_src_with_timestamp.append([image_src, keyframe_position / self.fps])
+        logger.info('%d images are saved for %d keyframes', n_saved, len(keyframe_positions))
         return keyframes_src_with_timestamp
 
+    def _read_frames(self, frame_positions: List[int]):
+        # yields frames at the sorted positions, the decoder seeks to the far positions
+        # instead of decoding every frame in between
+        min_seek_distance = max(1, int(MIN_SEEK_DISTANCE_SEC * self.fps))
+        seek_is_reliable = True
+        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
+        frame_ptr = -1
+        frame = None
+        for frame_position in frame_positions:
+            if seek_is_reliable and frame_position - frame_ptr > min_seek_distance:
+                frame = seek_capture(self.cap, frame_position)
+                if frame is not None:
+                    frame_ptr = frame_position
+                else:
+                    logger.warning('seeking is unreliable for "%s", reading frames sequentially', self.video_file_path)
+                    seek_is_reliable = False
+                    self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
+                    frame_ptr = -1
+
+            # skipped frames are only grabbed, the frame at the position is also retrieved
+            while frame_ptr < frame_position:
+                if not self.cap.grab():
+                    raise CreateSynopsisError('Wrong keyframe_position = {}'.format(frame_position))
+                frame_ptr += 1
+                if frame_ptr == frame_position:
+                    ret, frame = self.cap.retrieve()
+                    if not ret:
+                        raise CreateSynopsisError('Wrong keyframe_position = {}'.format(frame_position))
+            yield frame
+
 
 class VideoRecognitionNaive(VideoRecognitionBase):
     cascade = None
@@ -71,12 +154,17 @@ class VideoRecognitionNaive(VideoRecognitionBase):
 
     def __init__(self, video_file_path: str,
                  image_saver: ImageSaverBase = None,
-                 threshold: float = THRESHOLD_FOR_PEAKS_DETECTION):
+                 threshold: float = THRESHOLD_FOR_PEAKS_DETECTION,
+                 frame_source_class=FrameSourceOpenCV,
+                 frame_period_ms: float = None,
+                 detection_scale: float = HUMAN_DETECTION_SCALE,
+                 haar_cascade: str = HAAR_CASCADE_PATH):
         super().__init__(video_file_path, image_saver)
         self.threshold = threshold
+        self.detection_scale = detection_scale
+        self.frame_source = frame_source_class(video_file_path, FRAME_PERIOD, frame_period_ms=frame_period_ms)
 
-        haar_cascade = '/home/synopsis/recognition/video/static/HS.xml'
-        self.cascade = cv2.CascadeClassifier(haar_cascade)
+        self.cascade = get_haar_cascade(haar_cascade)
         if self.cascade.empty():
             raise CreateSynopsisError('VideoRecognition error, wrong haar cascade filename "{filename}"'
                                       .format(filename=haar_cascade))
@@ -85,16 +173,25 @@ class VideoRecognitionNaive(VideoRecognitionBase):
                                  height=int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
         self.num_of_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.fps = int(self.cap.get(cv2.CAP_PROP_FPS))
-        self.frames_between_keyframes = (TIME_BETWEEN_KEYFRAMES * self.fps) // FRAME_PERIOD
+        # frames of the video per sampled frame
+        self.frame_period = FRAME_PERIOD if frame_period_ms is None else frame_period_ms * self.fps / 1000
+        self.frames_between_keyframes = int((TIME_BETWEEN_KEYFRAMES * self.fps) // self.frame_period)
 
         self.diffs = []
         self.peaks = []
         self.humans = []
+        self.frame_positions = []
 
     def get_keyframes(self) -> List[int]:
-        self._compute_diffs()
+        # diffs do not depend on the threshold, so the next calls only find peaks again
+        if len(self.diffs) == 0:
+            try:
+                self._compute_diffs()
+            finally:
+                self.frame_source.release()
         self._find_peaks()
-        return list(map(lambda peak: int(max(1, peak * FRAME_PERIOD - self.fps)), self.peaks))
+        return list(map(lambda peak: int(max(1, self.frame_positions[peak] + 1 - self.frame_period - self.fps)),
+                        self.peaks))
 
     def _compute_diffs(self):
         old_frame = self._get_next_frame()
@@ -105,34 +202,80 @@ class VideoRecognitionNaive(VideoRecognitionBase):
                                                new_frame=new_frame))
             old_frame = new_frame
             new_frame = self._get_next_frame()
-            count += FRAME_PERIOD
+            count += self.frame_period
         self.bottom_line = float(np.mean(self.diffs) * BOTTOM_LINE_COEF)
 
     def _find_peaks(self):
-        threshold = self.threshold
-        first_try = True
+        # the threshold is raised by THRESHOLD_DELTA until there are at most max_num_of_keyframe peaks.
+        # Peaks of peakutils.indexes for a threshold are the candidates of the greedy min_dist selection
+        # which are higher than the threshold, so every step only counts them; the number of peaks can grow
+        # with the threshold when the last frame is appended, so the thresholds are tried one by one
+        diffs = np.array(self.diffs)
         max_num_of_keyframe = MAX_KEYFRAME_PER_SEC * self.num_of_frames / self.fps
         max_num_of_keyframe = max(max_num_of_keyframe, 1)
-        while ((len(self.peaks) > max_num_of_keyframe or first_try)
-               and threshold <= 1):
-            self.peaks = peakutils.indexes(np.array(self.diffs),
-                                           thres=threshold,
-                                           min_dist=self.frames_between_keyframes)
-            if (len(self.peaks) == 0
-                or len(self.diffs) - self.peaks[-1] > self.frames_between_keyframes):
-                self.peaks = np.append(self.peaks, [len(self.diffs) - 1])
-            self.peaks = list(
-                filter(lambda peak: not self._last_sec_video_is_bad(peak), self.peaks))
+
+        thresholds = []
+        threshold = self.threshold
+        while threshold <= 1:
+            thresholds.append(threshold)
             threshold += THRESHOLD_DELTA
-            first_try = False
+        if len(thresholds) == 0:
+            self.peaks = []
+            return
+
+        candidates = self._get_peak_candidates(diffs)
+        # -heights are sorted, so the number of candidates higher than a threshold is a binary search
+        heights = -diffs[candidates]
+        is_bad = self._last_sec_video_is_bad(np.arange(len(diffs)))
+        n_good = np.concatenate(([0], np.cumsum(~is_bad[candidates])))
+        last_peak = np.concatenate(([-1], np.maximum.accumulate(candidates))) if len(candidates) else np.array([-1])
+        last_ind = len(diffs) - 1
+        min_diff, max_diff = np.min(diffs), np.max(diffs)
+
+        def get_n_candidates(threshold):
+            absolute_threshold = threshold * (max_diff - min_diff) + min_diff
+            return int(np.searchsorted(heights, -absolute_threshold, side='left'))
+
+        def is_last_ind_appended(n_candidates):
+            return n_candidates == 0 or len(diffs) - last_peak[n_candidates] > self.frames_between_keyframes
+
+        def get_n_peaks(threshold):
+            n_candidates = get_n_candidates(threshold)
+            return n_good[n_candidates] + int(is_last_ind_appended(n_candidates) and not is_bad[last_ind])
+
+        for threshold in thresholds:
+            if get_n_peaks(threshold) <= max_num_of_keyframe:
+                break
+
+        n_candidates = get_n_candidates(threshold)
+        peaks = list(np.sort(candidates[:n_candidates]))
+        if is_last_ind_appended(n_candidates):
+            peaks.append(last_ind)
+        self.peaks = [peak for peak in peaks if not is_bad[peak]]
+
+    def _get_peak_candidates(self, diffs: np.ndarray) -> np.ndarray:
+        # peaks of peakutils.indexes with the zero threshold which are left by its min_dist selection
+        # if processed from the highest one, in the same order
+        peaks = peakutils.indexes(diffs, thres=0, min_dist=1)
+        highest = peaks[np.argsort(diffs[peaks])][::-1]
+        if len(highest) <= 1 or self.frames_between_keyframes <= 1:
+            return highest
+
+        removed = np.ones(diffs.size, dtype=bool)
+        removed[peaks] = False
+        candidates = []
+        for peak in highest:
+            if not removed[peak]:
+                removed[max(0, peak - self.frames_between_keyframes):peak + self.frames_between_keyframes + 1] = True
+                removed[peak] = False
+                candidates.append(peak)
+        return np.array(candidates, dtype=np.int64)
 
     def _get_next_frame(self):
-        frame = None
-        for i in range(FRAME_PERIOD):
-            ret, frame = self.cap.read()
-            if not ret:
-                return
-        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        frame = self.frame_source.read()
+        if frame is not None:
+            self.frame_positions.append(self.frame_source.position)
+        return frame
 
     def _frame_diff(self, old_frame, new_frame):
         if len(self.humans) == 0:
@@ -142,35 +285,34 @@ class VideoRecognitionNaive(VideoRecognitionBase):
         human_old_frame = self.humans[-2]
         human_new_frame = self.humans[-1]
 
-        old_frame_copy = old_frame.copy()
-        new_frame_copy = new_frame.copy()
-
         human = self._Human.union(human_old_frame, human_new_frame)
 
+        # the band of columns x_l..x_r with the human is excluded from the sum of the diff
+        column_sums = cv2.absdiff(old_frame, new_frame).sum(axis=0, dtype=np.int64)
+        diff = column_sums.sum()
         x_min, x_max, w = human.x_min, human.x_max, human.w
         num_of_pixels = self.shape.height * self.shape.width
         if w != 0:
             x_l = int(x_min - w * 0.15 if x_min - w * 0.15 >= 0 else 0)
             x_r = int(x_max + w * 0.15 if x_max + w * 0.15 < self.shape.width else self.shape.width)
-            for frame in [old_frame_copy, new_frame_copy]:
-                cv2.rectangle(frame, (x_l, 0), (x_r, self.shape.height), (0, 0, 0), cv2.FILLED)
-
-            abs_diff = cv2.absdiff(old_frame_copy, new_frame_copy)
+            diff -= column_sums[x_l:x_r + 1].sum()
             num_of_pixels -= self.shape.height * (x_r - x_l)
-        else:
-            abs_diff = cv2.absdiff(old_frame, new_frame)
 
-        return float(abs_diff.sum() / (num_of_pixels or 1))
+        return float(diff / (num_of_pixels or 1))
 
     def _find_human(self, frame):
+        # the cascade runs on the downscaled frame, rectangles are in the coordinates of the frame
+        scale = self.detection_scale
+        if scale != 1:
+            frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        min_size = int(self.shape.height * scale) // MIN_SIZE_COEF
         rectangles = self.cascade.detectMultiScale(frame,
                                                    scaleFactor=SCALE_FACTOR,
-                                                   minSize=(self.shape.height // MIN_SIZE_COEF,
-                                                            self.shape.height // MIN_SIZE_COEF))
+                                                   minSize=(min_size, min_size))
         if len(rectangles) == 0:
             return self._Human(0, 0, 0)
-        x_min = min([x for x, _, _, _ in rectangles] or [self.shape.width])
-        x_max = max([x + w for x, _, w, _ in rectangles] or [0])
+        x_min = int(min([x for x, _, _, _ in rectangles] or [self.shape.width * scale]) / scale)
+        x_max = int(max([x + w for x, _, w, _ in rectangles] or [0]) / scale)
         return self._Human(x_min=x_min, x_max=x_max, w=x_max - x_min)
 
     def _union_rectangles(self, lhs, rhs):
@@ -182,21 +324,23 @@ class VideoRecognitionNaive(VideoRecognitionBase):
                     max([x + w for x, _, w, _ in rhs] or [0]))
         return x_min, x_max, x_max - x_min
 
-    def _last_sec_video_is_bad(self, ind):
-        if ind < self.frames_between_keyframes:
-            return True
-        video_frame = 0
-        human_in_center_frames = 0
-        for i in range(1, self.frames_between_keyframes):
-            if self.diffs[ind - i] > self.bottom_line:
-                video_frame += 1
-
-            human = self.humans[ind - i]
-            if human.w > 0:
-                center = human.x_min + human.w / 2
-                if CENTER_LEFT_BORDER * self.shape.width <= center <= CENTER_RIGHT_BORDER * self.shape.width:
-                    human_in_center_frames += 1
-        return max(video_frame, human_in_center_frames) > self.frames_between_keyframes // 2
+    def _last_sec_video_is_bad(self, inds: np.ndarray) -> np.ndarray:
+        # for every index: most of the frames inds - frames_between_keyframes + 1..inds - 1 are a video
+        # or a human in the center, the frames are counted with prefix sums
+        is_video = np.array(self.diffs) > self.bottom_line
+        is_human_in_center = np.array([human.w > 0 and CENTER_LEFT_BORDER * self.shape.width
+                                       <= human.x_min + human.w / 2
+                                       <= CENTER_RIGHT_BORDER * self.shape.width
+                                       for human in self.humans[:len(self.diffs)]], dtype=bool)
+        video_frames = np.concatenate(([0], np.cumsum(is_video)))
+        human_in_center_frames = np.concatenate(([0], np.cumsum(is_human_in_center)))
+
+        inds = np.asarray(inds)
+        window_start = np.maximum(inds - self.frames_between_keyframes + 1, 0)
+        window_end = np.maximum(inds, window_start)
+        n_frames = np.maximum(video_frames[window_end] - video_frames[window_start],
+                              human_in_center_frames[window_end] - human_in_center_frames[window_start])
+        return (inds < self.frames_between_keyframes) | (n_frames > self.frames_between_keyframes // 2)
 
     class _Shape:
         width = None
@@ -262,6 +406,78 @@ class VideoRecognitionPySceneDetect(VideoRecognitionBase):
             self.stats_file = None
 
 
+# slide changes are found in the packet sizes and key flags of the container, no frame is decoded:
+# a new slide is encoded either as a packet much larger than the packets around it or as a key frame
+# forced by the encoder out of its regular interval
+class VideoRecognitionPackets(VideoRecognitionBase):
+    def __init__(self, video_file_path: str,
+                 image_saver: ImageSaverBase = None,
+                 min_length_sec: float = TIME_BETWEEN_KEYFRAMES,
+                 back_down_sec: float = 1,
+                 size_threshold_coef: float = PACKET_SIZE_THRESHOLD_COEF,
+                 window_sec: float = PACKET_WINDOW_SEC,
+                 max_frames_per_min: float = MAX_KEYFRAME_PER_MIN,
+                 ffprobe_binary: str = 'ffprobe'):
+        super().__init__(video_file_path, image_saver)
+        self.min_length_frames = int(min_length_sec * self.fps)
+        self.back_down_frames = int(back_down_sec * self.fps)
+        self.size_threshold_coef = size_threshold_coef
+        self.window_frames = max(1, int(window_sec * self.fps))
+        self.max_frames_per_min = max_frames_per_min
+        self.ffprobe_binary = ffprobe_binary
+        self.packets = None
+        self.scores = None
+
+    def get_keyframes(self) -> List[int]:
+        # a keyframe is a frame of the slide shortly before its change, the last slide ends with the video
+        changes = self.get_changes(self.max_frames_per_min)
+        keyframes = [max(0, change - self.back_down_frames) for change in changes]
+        last_frame = len(self.scores) - 1
+        if last_frame >= 0 and last_frame - max([0] + changes) > self.min_length_frames:
+            keyframes.append(max(0, last_frame - self.back_down_frames))
+        return keyframes
+
+    def get_changes(self, max_frames_per_min: float = None) -> List[int]:
+        # positions of the probable slide changes: the frames with the highest scores which are at least
+        # min_length_sec apart, no more than max_frames_per_min of them per minute of the video
+        if self.scores is None:
+            self.packets = read_packets(self.video_file_path, self.ffprobe_binary)
+            self.scores = self._compute_scores(self.packets)
+        max_changes = len(self.scores)
+        if max_frames_per_min is not None:
+            max_changes = int(np.ceil(len(self.scores) / self.fps / 60 * max_frames_per_min))
+
+        changes = []
+        is_free = np.ones(len(self.scores), dtype=bool)
+        for ind in np.argsort(-self.scores, kind='mergesort'):
+            if len(changes) >= max_changes or self.scores[ind] <= self.size_threshold_coef:
+                break
+            if is_free[ind]:
+                changes.append(int(ind))
+                is_free[max(0, ind - self.min_length_frames):ind + self.min_length_frames + 1] = False
+        return sorted(changes)
+
+    def _compute_scores(self, packets) -> np.ndarray:
+        # a packet size relative to the median size of the packets within window_sec around it,
+        # regular key frames are never changes and are not counted in the medians
+        scores = np.zeros(len(packets.sizes), dtype=np.float64)
+        key_inds = np.nonzero(packets.is_key)[0]
+        inds = np.nonzero(~packets.is_key)[0]
+        if len(inds) != 0:
+            medians = median_filter(packets.sizes[inds].astype(np.float64), size=2 * self.window_frames + 1,
+                                    mode='nearest')
+            scores[inds] = packets.sizes[inds] / np.maximum(medians, 1)
+
+        # the most frequent distance between key frames is the interval of the encoder,
+        # a key frame after a shorter distance is forced by a scene change
+        if len(key_inds) > 2:
+            key_distances = np.diff(key_inds)
+            regular_distance = np.argmax(np.bincount(key_distances))
+            forced_inds = key_inds[1:][key_distances < regular_distance]
+            scores[forced_inds] = np.inf
+        return scores
+
+
 class VideoRecognitionCells(VideoRecognitionBase):
     def __init__(self, video_file_path: str,
                  image_saver: ImageSaverBase = None,
@@ -276,75 +492,677 @@ class VideoRecognitionCells(VideoRecognitionBase):
                  cell_threshold_coef: float = 4,
                  peak_threshold: float = 0.4,
                  threshold_coef: float = 4,
-                 humans=None):
+                 humans=None,
+                 max_buffered_frames: int = 256,
+                 max_buffered_bytes: int = MAX_BUFFERED_BYTES,
+                 detection_scale: float = HUMAN_DETECTION_SCALE,
+                 detection_upsample: int = 1,
+                 detect_every: int = 1,
+                 min_tracking_confidence: float = 7,
+                 redetection_diff: float = 8,
+                 n_jobs: int = 1,
+                 frame_source_class=FrameSourceOpenCV,
+                 frame_period_ms: float = None,
+                 frame_cache_max_bytes: int = 0,
+                 frame_cache_dir: str = None,
+                 feature_store: FeatureStore = None,
+                 max_sampling_step: int = 1,
+                 static_cell_diff: float = 3,
+                 coarse_resize_coef: float = None,
+                 coarse_frame_period: int = 12,
+                 refine_window_sec: float = 4,
+                 packet_prefilter: bool = False,
+                 diff_resize_coef: float = None):
         super().__init__(video_file_path, image_saver)
         self.n_cells_width = n_cells_width
         self.n_cells_height = n_cells_height
         self.frame_period = frame_period
         self.min_length_sec = min_length_sec
+        self.back_down_sec = back_down_sec
         self.resize_coef = resize_coef
         self.image_diff = image_diff
         self.max_frames_per_min = max_frames_per_min
         self.cell_threshold_coef = cell_threshold_coef
         self.peak_threshold = peak_threshold
         self.threshold_coef = threshold_coef
+        # detection_scale is relative to the video, as in VideoRecognitionNaive, frames are already resized
+        self.detection_scale = detection_scale
+        self.frame_detection_scale = min(1, detection_scale / resize_coef)
+        self.detection_upsample = detection_upsample
+        self.detect_every = detect_every
+        self.min_tracking_confidence = min_tracking_confidence
+        self.redetection_diff = redetection_diff
+        self.n_jobs = n_jobs
+        self.max_sampling_step = max_sampling_step
+        self.static_cell_diff = static_cell_diff
+        self.coarse_resize_coef = coarse_resize_coef
+        self.coarse_frame_period = coarse_frame_period
+        self.refine_window_sec = refine_window_sec
+        self.packet_prefilter = packet_prefilter
+        # the cells diffs are computed on frames downscaled to diff_resize_coef of the video,
+        # humans are still detected on the frames of resize_coef
+        self.diff_resize_coef = diff_resize_coef
+        self.frame_cache_max_bytes = frame_cache_max_bytes
+        self.frame_cache_dir = frame_cache_dir
+        self.feature_store = feature_store
+        self.frame_source = frame_source_class(video_file_path, frame_period, resize_coef, frame_period_ms)
+        if frame_period_ms is not None:
+            # frames of the video per sampled frame
+            self.frame_period = frame_period_ms * self.fps / 1000
+        # everything the shards of _scan_video need to create the same recognizer in another process
+        self.scan_kwargs = dict(n_cells_width=n_cells_width,
+                                n_cells_height=n_cells_height,
+                                frame_period=frame_period,
+                                resize_coef=resize_coef,
+                                back_down_sec=back_down_sec,
+                                image_diff=image_diff,
+                                max_buffered_frames=max_buffered_frames,
+                                max_buffered_bytes=max_buffered_bytes,
+                                detection_scale=detection_scale,
+                                detection_upsample=detection_upsample,
+                                detect_every=detect_every,
+                                min_tracking_confidence=min_tracking_confidence,
+                                redetection_diff=redetection_diff,
+                                frame_source_class=frame_source_class,
+                                frame_period_ms=frame_period_ms,
+                                max_sampling_step=max_sampling_step,
+                                static_cell_diff=static_cell_diff,
+                                diff_resize_coef=diff_resize_coef)
+        # everything the humans and the cells diffs of _scan_video depend on
+        self.feature_params = dict(n_cells_width=n_cells_width,
+                                   n_cells_height=n_cells_height,
+                                   frame_period=frame_period,
+                                   frame_period_ms=frame_period_ms,
+                                   resize_coef=resize_coef,
+                                   image_diff=getattr(image_diff, '__name__', repr(image_diff)),
+                                   frame_source=frame_source_class.__name__,
+                                   detection_scale=detection_scale,
+                                   detection_upsample=detection_upsample,
+                                   detect_every=detect_every,
+                                   min_tracking_confidence=min_tracking_confidence,
+                                   redetection_diff=redetection_diff,
+                                   max_sampling_step=max_sampling_step,
+                                   static_cell_diff=static_cell_diff,
+                                   coarse_resize_coef=coarse_resize_coef,
+                                   coarse_frame_period=coarse_frame_period,
+                                   refine_window_sec=refine_window_sec,
+                                   packet_prefilter=packet_prefilter,
+                                   diff_resize_coef=diff_resize_coef)
         self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) * resize_coef)
         self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) * resize_coef)
         self.min_length_frames = int((min_length_sec * self.fps) // self.frame_period)
         self.back_down_frames = int((back_down_sec * self.fps) // self.frame_period)
-        self.humans = humans
+        diff_scale = min(1, diff_resize_coef / resize_coef) if diff_resize_coef is not None else 1
+        self.cells_grid = CellsGrid(self.width, self.height, n_cells_width, n_cells_height, diff_scale)
+        self.n_cells_width = self.cells_grid.n_cells_width
+        self.n_cells_height = self.cells_grid.n_cells_height
+        self.cells = self.cells_grid.cells
+        self.cells_areas = np.array([[cell.w * cell.h for cell in row] for row in self.cells], dtype=np.float32)
+        self.humans = RectangleArray.from_rectangles(humans) if humans is not None else None
+        self.cells_diffs = np.zeros((0, self.n_cells_height, self.n_cells_width), dtype=np.float32)
+        self.is_measured = np.zeros(0, dtype=bool)
+        self.frame_positions = np.zeros(0, dtype=np.int64)
+        # frames missed by the buffer are decoded again when needed
+        frame_bytes = max(1, self.frame_source.height * self.frame_source.width)
+        self.frame_buffer = FrameBuffer(min(max_buffered_frames, max_buffered_bytes // frame_bytes))
+        self.frame_cache = None
+        # the feature params of the last scan, see _get_feature_params
+        self.scanned_feature_params = None
+        # frames decoded and face detector calls, including the shards of _scan_video
+        self.counters = {'frames_decoded': 0, 'detector_calls': 0}
+        self.stage_stats = OrderedDict()
         self.segments = []
         self.peaks = []
         self.post_processed_peaks = []
 
-        self.cells = self._get_cells()
-
     def get_keyframes(self) -> List[int]:
-        logger.info('self._compute_humans()')
-        self._compute_humans()
-        logger.info('self._compute_segments()')
-        self._compute_segments()
-        logger.info('self._compute_cells_diffs()')
-        self._compute_cells_diffs()
-        logger.info('self._compute_cells_thresholds()')
-        self._compute_cells_thresholds()
-        logger.info('self._compute_relative_cells_diffs()')
-        self._compute_relative_cells_diffs()
-        logger.info('self._compute_diffs()')
-        self._compute_diffs()
-        logger.info('self._compute_threshold()')
-        self._compute_threshold()
-        logger.info('self._compute_peaks()')
-        self._compute_peaks()
-        logger.info('self._post_processing_segments()')
-        self._post_processing_segments()
-        logger.info('self._post_processing()')
-        self._post_processing()
-        return list(map(lambda item: (item + 1) * self.frame_period - 1, self.post_processed_peaks))
-
-    def _compute_humans(self):
+        # the frame source is opened again by the next seek if the features are rescanned
+        try:
+            return self._get_keyframes()
+        finally:
+            self._release_frame_cache()
+            self.frame_source.release()
+
+    def _get_keyframes(self) -> List[int]:
+        # the video is scanned once, the next calls only apply the current thresholds to the same features
+        # unless the features depend on the changed ones
+        self.stage_stats = OrderedDict()
+        feature_params = self._get_feature_params()
+        if feature_params != self.scanned_feature_params:
+            self._run_stage(self._scan_video)
+            self.scanned_feature_params = feature_params
+        self.segments = []
+        self.peaks = []
+        self.post_processed_peaks = []
+        for stage in (self._compute_segments,
+                      self._compute_cells_diffs,
+                      self._compute_cells_thresholds,
+                      self._compute_relative_cells_diffs,
+                      self._compute_diffs,
+                      self._compute_threshold,
+                      self._compute_peaks,
+                      self._post_processing_segments,
+                      self._post_processing):
+            self._run_stage(stage)
+        logger.info(json.dumps({'video_file_path': self.video_file_path, 'stages': self.stage_stats}))
+        return list(map(lambda item: int(self.frame_positions[item]), self.post_processed_peaks))
+
+    def _run_stage(self, stage):
+        # wall and CPU time of the stage, CPU time of finished child processes is included;
+        # bytes are the growth of the memory traced by tracemalloc, if it is started
+        logger.info('self.{}()'.format(stage.__name__))
+        counters = dict(self.counters)
+        is_tracing = tracemalloc.is_tracing()
+        traced_memory = tracemalloc.get_traced_memory()[0] if is_tracing else 0
+        wall_time = time.perf_counter()
+        cpu_time = self._get_cpu_time()
+
+        stage()
+
+        stats = OrderedDict()
+        stats['wall_sec'] = time.perf_counter() - wall_time
+        stats['cpu_sec'] = self._get_cpu_time() - cpu_time
+        for name, value in self.counters.items():
+            stats[name] = value - counters[name]
+        stats['bytes_allocated'] = tracemalloc.get_traced_memory()[0] - traced_memory if is_tracing else None
+        self.stage_stats[stage.__name__] = stats
+
+    @staticmethod
+    def _get_cpu_time() -> float:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return time.process_time() + children.ru_utime + children.ru_stime
+
+    def _get_feature_params(self) -> dict:
+        # the windows scanned by the coarse-to-fine and the packet pre-filtered scans depend on the thresholds
+        # which find the peaks of the coarse pass and the changes of the packets
+        feature_params = dict(self.feature_params)
+        if self.coarse_resize_coef is not None:
+            feature_params.update(cell_threshold_coef=self.cell_threshold_coef,
+                                  peak_threshold=self.peak_threshold,
+                                  threshold_coef=self.threshold_coef,
+                                  max_frames_per_min=self.max_frames_per_min)
+        if self.coarse_resize_coef is not None or self.packet_prefilter:
+            feature_params.update(min_length_sec=self.min_length_sec, back_down_sec=self.back_down_sec)
+        return feature_params
+
+    def _scan_video(self):
+        # the only sequential decoding of the video: humans and cells diffs between neighbouring
+        # frames are computed here, later stages take the frames they need from self.frame_buffer
+        self.frame_buffer.clear()
+        feature_params = self._get_feature_params()
+        if self.feature_store is not None:
+            scan_result = self.feature_store.load(self.video_file_path, feature_params)
+            if scan_result is not None:
+                logger.info('features of the video are loaded from the feature store')
+                humans = self.humans
+                self._set_scan_result(scan_result)
+                if humans is not None:
+                    self.humans = humans
+                return
+
+        self._create_frame_cache()
+        if self.coarse_resize_coef is not None:
+            self._set_scan_result(self._scan_coarse_to_fine())
+        elif self.packet_prefilter:
+            self._set_scan_result(self._scan_prefiltered())
+        elif self.n_jobs <= 1:
+            self._set_scan_result(self._scan_range(0, None, self.humans, self.frame_buffer, self.frame_cache))
+        else:
+            self._scan_video_parallel()
+
+        if self.feature_store is not None:
+            self.feature_store.save(self.video_file_path, feature_params,
+                                    ScanResult(self.humans, self.cells_diffs, self.frame_positions, self.is_measured))
+
+    def _set_scan_result(self, scan_result: ScanResult):
+        self.humans = RectangleArray.from_rectangles(scan_result.humans)
+        self.cells_diffs = scan_result.cells_diffs
+        self.frame_positions = scan_result.frame_positions
+        self.is_measured = scan_result.is_measured
+
+    def _scan_video_parallel(self):
+        n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) // self.frame_period)
+        bounds = [n_frames * i // self.n_jobs for i in range(self.n_jobs + 1)]
+        if not all(self.frame_source.can_seek(bound) for bound in bounds[1:-1]):
+            # shards would decode the video from the start to get to their first frames
+            logger.warning('seeking is unreliable for "%s", scanning the video sequentially', self.video_file_path)
+            self._set_scan_result(self._scan_range(0, None, self.humans, self.frame_buffer, self.frame_cache))
+            return
+        shard_kwargs = dict(self.scan_kwargs,
+                            max_buffered_frames=max(1, self.frame_buffer.capacity // self.n_jobs))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+            futures = []
+            for i in range(self.n_jobs):
+                # the last shard reads up to the end, the frame count of a container is not always exact
+                first_frame, last_frame = bounds[i], bounds[i + 1] if i + 1 < self.n_jobs else None
+                humans = self.humans[first_frame:last_frame] if self.humans is not None else None
+                frame_cache_args = self.frame_cache.get_args() if self.frame_cache is not None else None
+                futures.append(pool.submit(_scan_video_shard, self.video_file_path, shard_kwargs,
+                                           first_frame, last_frame, humans, frame_cache_args))
+            results = [future.result() for future in futures]
+
+        self.humans = RectangleArray.concatenate([scan_result.humans for scan_result, _, _, _ in results])
+        for scan_result, buffered_frames, counters, written_frames in results:
+            for index, frame, priority in buffered_frames:
+                self.frame_buffer.add(index, frame, priority)
+            for name, value in counters.items():
+                self.counters[name] += value
+            if self.frame_cache is not None:
+                self.frame_cache.set_written(written_frames)
+        self.cells_diffs = np.concatenate([scan_result.cells_diffs for scan_result, _, _, _ in results])
+        self.frame_positions = np.concatenate([scan_result.frame_positions for scan_result, _, _, _ in results])
+        self.is_measured = np.concatenate([scan_result.is_measured for scan_result, _, _, _ in results])
+
+    def _scan_coarse_to_fine(self) -> ScanResult:
+        # the whole video is recognized at coarse_resize_coef and coarse_frame_period first, only windows
+        # around every coarse peak candidate and segment border are scanned at the configured resolution
+        # and period, outside them humans and cells diffs are taken from the nearest frames of the coarse pass.
+        # Faces are too small for the detector at coarse_resize_coef, so when humans are detected
+        # the coarse pass decodes the frames at resize_coef and only its cells diffs are computed
+        # on frames downscaled to coarse_resize_coef
+        coarse_resize_coef = self.coarse_resize_coef if self.humans is not None else self.resize_coef
+        coarse = VideoRecognitionCells(self.video_file_path,
+                                       **dict(self.scan_kwargs,
+                                              resize_coef=coarse_resize_coef,
+                                              diff_resize_coef=self.coarse_resize_coef,
+                                              frame_period=self.coarse_frame_period,
+                                              frame_period_ms=None,
+                                              min_length_sec=self.min_length_sec,
+                                              max_frames_per_min=self.max_frames_per_min,
+                                              cell_threshold_coef=self.cell_threshold_coef,
+                                              peak_threshold=self.peak_threshold,
+                                              threshold_coef=self.threshold_coef,
+                                              n_jobs=self.n_jobs))
+        frame_positions = self._get_sample_positions()
+        if self.humans is not None and len(frame_positions) != 0:
+            # the given humans of the closest samples, the coarse pass does not detect them at its resolution
+            inds = self._get_nearest_inds(frame_positions, coarse._get_sample_positions())
+            coarse.humans = self.humans[inds].scale(coarse_resize_coef / self.resize_coef)
+        coarse.get_keyframes()
+        for name, value in coarse.counters.items():
+            self.counters[name] += value
+        if len(coarse.cells_diffs) == 0:
+            return self._scan_range(0, None, self.humans, self.frame_buffer, self.frame_cache)
+
         if self.humans is not None:
+            humans = self.humans.copy()
+        else:
+            humans = coarse.humans[self._get_nearest_inds(coarse.frame_positions, frame_positions)]
+
+        coarse_cells_diffs = coarse.cells_diffs
+        if coarse_cells_diffs.shape[1:] == self.cells_areas.shape:
+            areas_ratio = self.cells_areas / coarse.cells_areas
+        else:
+            coarse_cells_diffs = np.array([cv2.resize(cells_diff, (self.n_cells_width, self.n_cells_height),
+                                                      interpolation=cv2.INTER_NEAREST)
+                                           for cells_diff in coarse_cells_diffs])
+            areas_ratio = (self.cells_grid.width * self.cells_grid.height
+                           / (coarse.cells_grid.width * coarse.cells_grid.height))
+        # a coarse diff spans several fine samples, it is spread evenly over them
+        diff_inds = self._get_spanning_inds(coarse.frame_positions[:len(coarse_cells_diffs) + 1],
+                                            frame_positions[:-1])
+        n_spanned = np.bincount(diff_inds, minlength=len(coarse_cells_diffs))[diff_inds]
+        cells_diffs = (coarse_cells_diffs[diff_inds] * areas_ratio
+                       / n_spanned[:, np.newaxis, np.newaxis]).astype(np.float32)
+
+        # the peaks of the coarse diffs before the filters of _compute_peaks and post-processing,
+        # and the coarse diffs far above the local median: the cells thresholds of a coarse segment are
+        # raised by its own changes and by motion, so a change can leave no changed cells in segment.diffs
+        candidates = set(coarse.post_processed_peaks)
+        for segment in coarse.segments:
+            candidates.update(segment.frame_numbers[peakutils.indexes(segment.diffs, self.peak_threshold)])
+            candidates.update((segment.frame_numbers[0], segment.frame_numbers[-1]))
+
+        coarse_frame_diffs = coarse.cells_diffs.sum(axis=(1, 2))
+        coarse_window = int(self.refine_window_sec * self.fps / self.coarse_frame_period)
+        local_medians = median_filter(coarse_frame_diffs, size=2 * coarse_window + 1, mode='nearest')
+        candidates.update(np.flatnonzero(coarse_frame_diffs > COARSE_LOCAL_DIFF_COEF * local_medians).tolist())
+
+        # the diff of a candidate is between the coarse frames candidate and candidate + 1
+        ranges = []
+        for candidate in candidates:
+            next_candidate = min(candidate + 1, len(coarse.frame_positions) - 1)
+            ranges.append((int(np.searchsorted(frame_positions, coarse.frame_positions[candidate])),
+                           int(np.searchsorted(frame_positions, coarse.frame_positions[next_candidate]))))
+        if self.packet_prefilter:
+            ranges.extend(self._get_packet_ranges(frame_positions))
+
+        is_measured = self._refine_windows(self._get_windows(ranges, len(frame_positions)), humans, cells_diffs,
+                                           frame_positions)
+        return ScanResult(humans=humans, cells_diffs=cells_diffs, frame_positions=frame_positions,
+                          is_measured=is_measured)
+
+    def _scan_prefiltered(self) -> ScanResult:
+        # only windows around the changes found by VideoRecognitionPackets and the ends of the video are decoded,
+        # outside them the cells diffs are zero and humans are copied from the closest decoded frame before,
+        # the zero diffs are not measured and are left out of the thresholds
+        frame_positions = self._get_sample_positions()
+        n_frames = len(frame_positions)
+        if n_frames == 0:
+            return self._scan_range(0, None, self.humans, self.frame_buffer, self.frame_cache)
+
+        humans = self.humans.copy() if self.humans is not None else RectangleArray.empty(n_frames)
+        cells_diffs = np.zeros((max(0, n_frames - 1), self.n_cells_height, self.n_cells_width), dtype=np.float32)
+        ranges = self._get_packet_ranges(frame_positions) + [(0, 0), (n_frames - 1, n_frames - 1)]
+        windows = self._get_windows(ranges, n_frames)
+        is_measured = self._refine_windows(windows, humans, cells_diffs, frame_positions)
+
+        if self.humans is None:
+            # humans of a window are computed for all its frames but the last one
+            is_scanned = np.zeros(n_frames, dtype=bool)
+            for first_frame, last_frame in windows:
+                is_scanned[first_frame:last_frame] = True
+            if np.any(is_scanned):
+                inds = np.maximum.accumulate(np.where(is_scanned, np.arange(n_frames), -1))
+                inds[inds < 0] = np.argmax(is_scanned)
+                humans = humans[inds]
+        return ScanResult(humans=humans, cells_diffs=cells_diffs, frame_positions=frame_positions,
+                          is_measured=is_measured)
+
+    @staticmethod
+    def _get_nearest_inds(positions: np.ndarray, other_positions: np.ndarray) -> np.ndarray:
+        # the index of the nearest of the sorted positions to every one of other_positions
+        inds = np.clip(np.searchsorted(positions, other_positions), 1, max(1, len(positions) - 1))
+        if len(positions) < 2:
+            return np.zeros(len(other_positions), dtype=np.int64)
+        is_left_nearer = other_positions - positions[inds - 1] <= positions[inds] - other_positions
+        return np.where(is_left_nearer, inds - 1, inds)
+
+    @staticmethod
+    def _get_spanning_inds(positions: np.ndarray, other_positions: np.ndarray) -> np.ndarray:
+        # the index of the diff between positions[i] and positions[i + 1] which contains the diff
+        # starting at every one of other_positions, the first or the last diff outside of them
+        inds = np.searchsorted(positions, other_positions, side='right') - 1
+        return np.clip(inds, 0, max(0, len(positions) - 2))
+
+    def _get_sample_positions(self) -> np.ndarray:
+        n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) // self.frame_period)
+        return np.array([self.frame_source.get_sample_position(frame_number) for frame_number in range(n_frames)],
+                        dtype=np.int64)
+
+    def _get_packet_ranges(self, frame_positions: np.ndarray) -> List[tuple]:
+        # every change of the packets is between two neighbouring samples
+        packets_recognizer = VideoRecognitionPackets(self.video_file_path, min_length_sec=self.min_length_sec)
+        ranges = []
+        for change in packets_recognizer.get_changes():
+            ind = int(np.searchsorted(frame_positions, change))
+            ranges.append((max(0, ind - 1), ind))
+        logger.info('%d changes are found in the packets', len(ranges))
+        return ranges
+
+    def _get_windows(self, ranges: List[tuple], n_frames: int) -> List[tuple]:
+        # ranges of samples are extended by refine_window_sec and by back_down_sec before them,
+        # the overlapping ones are merged
+        windows = []
+        window = int(self.refine_window_sec * self.fps / self.frame_period)
+        for first_frame, last_frame in sorted(ranges):
+            first_frame = max(0, first_frame - self.back_down_frames - window)
+            last_frame = min(n_frames - 1, last_frame + window)
+            if len(windows) != 0 and first_frame <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], last_frame))
+            else:
+                windows.append((first_frame, last_frame))
+        return windows
+
+    def _refine_windows(self, windows: List[tuple], humans: RectangleArray, cells_diffs: np.ndarray,
+                        frame_positions: np.ndarray) -> np.ndarray:
+        # the windows are scanned at the configured resolution and period, their results replace
+        # the values of humans, cells_diffs and frame_positions in place, the measured cells diffs are returned
+        is_measured = np.zeros(len(cells_diffs), dtype=bool)
+        for first_frame, last_frame in windows:
+            logger.info('refining frames %d..%d', first_frame, last_frame)
+            window_humans = self.humans[first_frame:last_frame] if self.humans is not None else None
+            scan_result = self._scan_range(first_frame, last_frame, window_humans, self.frame_buffer,
+                                           self.frame_cache)
+            humans[first_frame:first_frame + len(scan_result.humans)] = scan_result.humans
+            cells_diffs[first_frame:first_frame + len(scan_result.cells_diffs)] = scan_result.cells_diffs
+            frame_positions[first_frame:first_frame + len(scan_result.frame_positions)] = scan_result.frame_positions
+            is_measured[first_frame:first_frame + len(scan_result.cells_diffs)] = True
+        return is_measured
+
+    def _create_frame_cache(self):
+        self._release_frame_cache()
+        if self.frame_cache_max_bytes <= 0:
             return
+        n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) // self.frame_period) + 1
+        height, width = self.frame_source.height, self.frame_source.width
+        if n_frames * height * width > self.frame_cache_max_bytes:
+            logger.info('%d frames do not fit the frame cache, they will be decoded again when needed', n_frames)
+            return
+        self.frame_cache = FrameCache.create(n_frames, height, width, self.frame_cache_dir)
+
+    def _release_frame_cache(self):
+        if self.frame_cache is not None:
+            self.frame_cache.release()
+            self.frame_cache = None
+
+    def _scan_range(self, first_frame: int, last_frame: int = None, humans: RectangleArray = None,
+                    frame_buffer: FrameBuffer = None, frame_cache: FrameCache = None) -> ScanResult:
+        # decodes frames first_frame..last_frame, humans are computed for [first_frame, last_frame),
+        # cells diffs for every pair of neighbouring frames
+        if frame_buffer is None:
+            frame_buffer = FrameBuffer(0)
+        compute_humans = humans is None
+        if compute_humans:
+            humans = []
+        # with detect_every > 1 humans are tracked frame by frame, with adaptive sampling humans are detected
+        # in the analysed frames only
+        adaptive_sampling = self.max_sampling_step > 1
+        if adaptive_sampling and not self.frame_source.can_seek(first_frame + 1):
+            # skipped frames are read again after seeking back to them
+            logger.warning('seeking is unreliable for "%s", adaptive sampling is off', self.video_file_path)
+            adaptive_sampling = False
+        human_tracker = None
+        if compute_humans and self.detect_every > 1:
+            human_tracker = HumanTracker(detect_every=self.detect_every,
+                                         min_confidence=self.min_tracking_confidence,
+                                         scale=self.frame_detection_scale,
+                                         upsample_num_times=self.detection_upsample)
+        if last_frame is None:
+            n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) // self.frame_period) - first_frame
+        else:
+            n_frames = last_frame - first_frame
+        cells_diffs = np.zeros((max(1, n_frames), self.n_cells_height, self.n_cells_width), dtype=np.float32)
+        frame_positions = []
+        recent_frames = deque(maxlen=self.back_down_frames + 2)
+        ind = first_frame
+
+        def add_frame(frame, cells_diff=None, human=None):
+            # cells_diff is the diff with the previous frame, human is given for frames which are not analysed;
+            # frame is None for a frame which is skipped by adaptive sampling and not decoded
+            nonlocal cells_diffs, ind
+            pos = ind - first_frame
+            if frame_cache is not None and frame is not None:
+                frame_cache.add(ind, frame)
+            if len(recent_frames) != 0:
+                prev_ind, prev_frame = recent_frames[-1]
+                if cells_diff is None:
+                    cells_diff = self._get_frame_diff(prev_frame, frame)
+                if pos - 1 == len(cells_diffs):
+                    cells_diffs = np.concatenate((cells_diffs, np.zeros_like(cells_diffs)))
+                cells_diffs[pos - 1] = cells_diff
+            else:
+                cells_diff = None
+                # the left neighbour of the first frame can be in another shard
+                frame_buffer.add(ind, frame)
+
+            if compute_humans and (last_frame is None or ind < last_frame):
+                if human is None and human_tracker is not None:
+                    frame_changed = cells_diff is not None and np.sum(cells_diff) > self.redetection_diff * frame.size
+                    human = human_tracker.get_rectangle_with_human(frame, force_detection=frame_changed)
+                elif human is None:
+                    self.counters['detector_calls'] += 1
+                    human = get_rectangle_with_human_dlib(frame,
+                                                          scale=self.frame_detection_scale,
+                                                          upsample_num_times=self.detection_upsample)
+                humans.append(human)
+
+            if cells_diff is not None:
+                # the frame which is taken as a keyframe if this diff turns out to be a peak
+                candidate_position = max(0, len(recent_frames) - self.back_down_frames - 1)
+                candidate_ind, candidate_frame = recent_frames[candidate_position]
+                if candidate_frame is not None:
+                    frame_buffer.add(candidate_ind, candidate_frame, float(np.sum(cells_diff)))
+
+                # frames on the borders of segments
+                if (pos < len(humans)
+                        and self._frame_type(humans[pos - 1]) != self._frame_type(humans[pos])):
+                    if prev_frame is not None:
+                        frame_buffer.add(prev_ind, prev_frame)
+                    if frame is not None:
+                        frame_buffer.add(ind, frame)
+
+            recent_frames.append((ind, frame))
+            ind += 1
+
+        def add_step(frame, n_step_frames: int):
+            # adaptive sampling: frame is the last one of a step of n_step_frames frames starting at ind, the others
+            # are only grabbed. If nothing changes over the step, the diff over the whole step is spread evenly over
+            # its frames and the skipped frames get the human of the last analysed frame without being decoded,
+            # otherwise they are read again and analysed one by one. The spread diffs stay in the thresholds:
+            # static steps are most of a lecture, without them the thresholds would be of the changes only
+            cells_diff = self._get_frame_diff(recent_frames[-1][1], frame)
+            if n_step_frames == 1:
+                add_frame(frame, cells_diff)
+                return self._is_static(cells_diff)
+            if self._is_static(cells_diff):
+                human = humans[-1] if compute_humans and len(humans) != 0 else None
+                cells_diff = cells_diff / n_step_frames
+                for _ in range(n_step_frames - 1):
+                    add_frame(None, cells_diff, human)
+                add_frame(frame, cells_diff)
+                return True
+
+            self._seek(ind)
+            for _ in range(n_step_frames - 1):
+                skipped_frame = self._get_next_frame()
+                if skipped_frame is None:
+                    raise CreateSynopsisError('Failed to decode frame {} again'.format(ind))
+                add_frame(skipped_frame)
+            # the source is at the frame of the step again
+            self.frame_source.skip()
+            add_frame(frame)
+            return False
 
-        self.humans = []
-        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
-        frame = self._get_next_frame()
-        while frame is not None:
-            self.humans.append(get_rectangle_with_human_dlib(frame))
-            frame = self._get_next_frame()
+        self._seek(first_frame)
+        frame = self._get_next_frame(frame_positions)
+        if frame is not None:
+            add_frame(frame)
+        # the step grows while nothing changes
+        sampling_step = 1
+        while frame is not None and (last_frame is None or ind <= last_frame):
+            if not adaptive_sampling:
+                frame = self._get_next_frame(frame_positions)
+                if frame is not None:
+                    add_frame(frame)
+                continue
 
-    def _compute_segments(self):
-        def frame_type(h) -> VideoRecognitionCells.SegmentType:
-            if self._is_human_in_center(h):
-                return self.SegmentType.HUMAN_CENTER
-            elif h.is_empty():
-                return self.SegmentType.EMPTY
+            n_step_frames = sampling_step if last_frame is None else min(sampling_step, last_frame + 1 - ind)
+            n_skipped = 0
+            while n_skipped < n_step_frames - 1 and self._skip_next_frame(frame_positions):
+                n_skipped += 1
+            frame = self._get_next_frame(frame_positions) if n_skipped == n_step_frames - 1 else None
+            if frame is None and n_skipped != 0:
+                # the end of the video, the step is cut at the last skipped frame
+                self._seek(ind + n_skipped - 1)
+                frame = self._get_next_frame()
+                n_step_frames = n_skipped
+            if frame is None:
+                break
+            if add_step(frame, n_step_frames):
+                sampling_step = min(2 * sampling_step, self.max_sampling_step)
+            else:
+                sampling_step = 1
+
+        for recent_ind, recent_frame in recent_frames:
+            if recent_frame is not None:
+                frame_buffer.add(recent_ind, recent_frame)
+        if human_tracker is not None:
+            self.counters['detector_calls'] += human_tracker.detector_calls
+
+        n_frames = ind - first_frame if last_frame is None else min(ind, last_frame) - first_frame
+        n_diffs = max(0, ind - first_frame - 1)
+        return ScanResult(humans=RectangleArray.from_rectangles(humans),
+                          cells_diffs=cells_diffs[:n_diffs].copy(),
+                          frame_positions=np.array(frame_positions[:n_frames], dtype=np.int64),
+                          is_measured=np.ones(n_diffs, dtype=bool))
+
+    def _is_static(self, cells_diff: np.ndarray) -> bool:
+        return bool(np.all(cells_diff < self.static_cell_diff * self.cells_areas))
+
+    def _seek(self, frame_number: int):
+        self.frame_source.seek(frame_number)
+
+    def _get_frames(self, frame_numbers: Iterable[int]) -> Dict[int, np.ndarray]:
+        frames = {}
+        missed = set()
+        for frame_number in frame_numbers:
+            if frame_number in self.frame_buffer:
+                frames[frame_number] = self.frame_buffer.get(frame_number)
+            elif self.frame_cache is not None and frame_number in self.frame_cache:
+                frames[frame_number] = self.frame_cache.get(frame_number)
             else:
-                return self.SegmentType.HUMAN_SIDE
+                missed.add(frame_number)
+
+        if len(missed) == 0:
+            return frames
+
+        # the frames are decoded by self.frame_source as in the scan, it seeks to the far frames
+        # and reads the close ones
+        logger.info('%d frames are neither buffered nor cached, decoding them again', len(missed))
+        min_seek_distance = max(1, int(MIN_SEEK_DISTANCE_SEC * self.fps / self.frame_period))
+        next_frame_number = None
+        for frame_number in sorted(missed):
+            if next_frame_number is None or not 0 <= frame_number - next_frame_number <= min_seek_distance:
+                self._seek(frame_number)
+                next_frame_number = frame_number
+            while next_frame_number <= frame_number:
+                frame = self.frame_source.read()
+                if frame is None:
+                    raise CreateSynopsisError('Failed to decode frame {} again'.format(frame_number))
+                self.counters['frames_decoded'] += 1
+                next_frame_number += 1
+            frames[frame_number] = frame
+        return frames
+
+    def _get_pairs_diffs(self, lhs_inds: np.ndarray, rhs_inds: np.ndarray,
+                         humans: RectangleArray = None) -> np.ndarray:
+        result = np.zeros((len(lhs_inds), self.n_cells_height, self.n_cells_width), dtype=np.float32)
+        if humans is None:
+            neighbours = rhs_inds == lhs_inds + 1
+            result[neighbours] = self.cells_diffs[lhs_inds[neighbours]]
+            to_compute = np.flatnonzero(~neighbours)
+        else:
+            to_compute = np.arange(len(lhs_inds))
+
+        frames = self._get_frames(frame_number
+                                  for i in to_compute
+                                  for frame_number in (lhs_inds[i], rhs_inds[i]))
+        for i in to_compute:
+            result[i] = self._get_frame_diff(frames[lhs_inds[i]], frames[rhs_inds[i]],
+                                             humans[i] if humans is not None else None)
+        return result
 
+    def _frame_type(self, human) -> 'VideoRecognitionCells.SegmentType':
+        if self._is_human_in_center(human):
+            return self.SegmentType.HUMAN_CENTER
+        elif human.is_empty():
+            return self.SegmentType.EMPTY
+        else:
+            return self.SegmentType.HUMAN_SIDE
+
+    def _frame_types(self, humans: RectangleArray) -> np.ndarray:
+        # the same as _frame_type for every human
+        is_empty = humans.is_empty()
+        human_centers = humans.x + humans.w / 2
+        is_in_center = ~is_empty & ((humans.w.astype(np.int64) * humans.h > (2 / 3) * self.width * self.height)
+                                    | ((self.width * 0.4 <= human_centers) & (human_centers <= self.width * 0.6)))
+        kinds = np.array([self.SegmentType.HUMAN_SIDE, self.SegmentType.EMPTY, self.SegmentType.HUMAN_CENTER])
+        return kinds[np.where(is_in_center, 2, np.where(is_empty, 1, 0))]
+
+    def _compute_segments(self):
         segments = []
-        for ind, human in enumerate(self.humans):
-            cur_frame_type = frame_type(human)
+        for ind, cur_frame_type in enumerate(self._frame_types(self.humans[:len(self.cells_diffs) + 1])):
             if cur_frame_type == self.SegmentType.HUMAN_CENTER:
                 continue
 
@@ -366,86 +1184,56 @@ class VideoRecognitionCells(VideoRecognitionBase):
             else:
                 self.segments[-1].frame_numbers.extend(segment.frame_numbers)
 
-    def _compute_cells_diffs(self):
-        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
-        frame_ptr = 0
         for segment in self.segments:
-            lhs_frame = self._get_next_frame_by_ptr(frame_ptr, segment.frame_numbers[0])
-            frame_ptr = segment.frame_numbers[0] + 1
-            for i in range(1, len(segment.frame_numbers)):
-                rhs_frame = self._get_next_frame_by_ptr(frame_ptr, segment.frame_numbers[i])
-                frame_ptr = segment.frame_numbers[i] + 1
-                diff = self._get_frame_diff(lhs_frame, rhs_frame)
-                segment.absolute_cells_diffs.append(diff)
-                lhs_frame = rhs_frame
-
-    def _get_next_frame_by_ptr(self, cur_ptr, target_frame):
-        if cur_ptr > target_frame:
-            logger.warning('cur_ptr > target_frame')
-            return None
-        frame = self._get_next_frame()
-        while cur_ptr != target_frame:
-            frame = self._get_next_frame()
-            cur_ptr += 1
+            segment.set_frame_numbers(segment.frame_numbers)
 
-        return frame
+    def _compute_cells_diffs(self):
+        for segment in self.segments:
+            first_frame, last_frame = int(segment.frame_numbers[0]), int(segment.frame_numbers[-1])
+            if last_frame - first_frame == len(segment.frame_numbers) - 1:
+                # the frames of the segment are neighbours, their diffs are a slice of self.cells_diffs
+                segment.absolute_cells_diffs = self.cells_diffs[first_frame:last_frame]
+                segment.is_measured = self.is_measured[first_frame:last_frame]
+            else:
+                # the diffs of neighbouring pairs are taken from self.cells_diffs and measured as they are there,
+                # the other pairs are computed from the frames
+                lhs_inds, rhs_inds = segment.frame_numbers[:-1], segment.frame_numbers[1:]
+                segment.absolute_cells_diffs = self._get_pairs_diffs(lhs_inds, rhs_inds)
+                segment.is_measured = np.where(rhs_inds == lhs_inds + 1, self.is_measured[lhs_inds], True)
 
-    def _get_frame_diff(self, lhs_frame, rhs_frame, human=None) -> List[list]:
-        result = [[0 for _ in range(self.n_cells_width)]
-                  for _ in range(self.n_cells_height)]
-
-        for i in range(self.n_cells_height):
-            for j in range(self.n_cells_width):
-                if human is not None and Rectangle.is_intersect(human, self.cells[i][j]):
-                    result[i][j] = 0
-                else:
-                    p1, p2 = self.cells[i][j].get_points()
-                    result[i][j] = self.image_diff(lhs_frame[p1[1]:p2[1], p1[0]:p2[0]],
-                                                   rhs_frame[p1[1]:p2[1], p1[0]:p2[0]])
-        return result
+    def _get_frame_diff(self, lhs_frame, rhs_frame, human=None) -> np.ndarray:
+        return self.cells_grid.diff(lhs_frame, rhs_frame, self.image_diff, human)
 
     def _compute_cells_thresholds(self):
+        # the statistics are taken over the measured diffs only, approximated ones would bias them
         for segment in self.segments:
-            segment.cells_thresholds = [[0 for _ in range(self.n_cells_width)]
-                                        for _ in range(self.n_cells_height)]
-            for i in range(self.n_cells_height):
-                for j in range(self.n_cells_width):
-                    cell_diffs = list(map(lambda item: item[i][j], segment.absolute_cells_diffs))
-                    mean = np.mean(cell_diffs)
-                    sd = np.std(cell_diffs)
-                    segment.cells_thresholds[i][j] = mean + self.cell_threshold_coef * sd
+            cells_diffs = segment.measured(segment.absolute_cells_diffs)
+            mean = np.mean(cells_diffs, axis=0, dtype=np.float64)
+            sd = np.std(cells_diffs, axis=0, dtype=np.float64)
+            segment.cells_thresholds = mean + self.cell_threshold_coef * sd
 
     def _compute_relative_cells_diffs(self):
         for segment in self.segments:
-            for absolute_cells_diff in segment.absolute_cells_diffs:
-                relative_cells_diff = self._absolute_to_relative_cells_diff(absolute_cells_diff,
-                                                                            segment.cells_thresholds)
-                segment.relative_cells_diffs.append(relative_cells_diff)
-
-    def _absolute_to_relative_cells_diff(self, absolute_cells_diff, cells_thresholds):
-        relative_cells_diff = [[0 for _ in range(self.n_cells_width)]
-                               for _ in range(self.n_cells_height)]
-        for i in range(self.n_cells_height):
-            for j in range(self.n_cells_width):
-                relative_cells_diff[i][j] = 1 if (absolute_cells_diff[i][j] > cells_thresholds[i][j]) else 0
-        return relative_cells_diff
+            segment.relative_cells_diffs = self._absolute_to_relative_cells_diff(segment.absolute_cells_diffs,
+                                                                                 segment.cells_thresholds)
+
+    @staticmethod
+    def _absolute_to_relative_cells_diff(absolute_cells_diff, cells_thresholds) -> np.ndarray:
+        return absolute_cells_diff > cells_thresholds
 
     def _compute_diffs(self):
         for segment in self.segments:
-            for relative_cells_diff in segment.relative_cells_diffs:
-                segment.diffs.append(self._cells_diff_to_frame_diff(relative_cells_diff))
+            segment.diffs = self._cells_diff_to_frame_diff(segment.relative_cells_diffs)
 
-    def _cells_diff_to_frame_diff(self, relative_cells_diff):
-        diff = 0
-        for i in range(self.n_cells_height):
-            for j in range(self.n_cells_width):
-                diff += relative_cells_diff[i][j]
-        return diff
+    @staticmethod
+    def _cells_diff_to_frame_diff(relative_cells_diff):
+        return relative_cells_diff.sum(axis=(-2, -1))
 
     def _compute_threshold(self):
         for segment in self.segments:
-            mean = np.mean(segment.diffs)
-            sd = np.std(segment.diffs)
+            diffs = segment.measured(segment.diffs)
+            mean = np.mean(diffs)
+            sd = np.std(diffs)
             segment.threshold = mean + self.threshold_coef * sd
 
     def _compute_peaks(self):
@@ -461,32 +1249,36 @@ class VideoRecognitionCells(VideoRecognitionBase):
             if len(self.segments[-1].peaks) == 0:
                 self.segments[-1].peaks.append(self.segments[-1].frame_numbers[-1])
             else:
-                last_peak_ind = self.segments[-1].frame_numbers.index(self.segments[-1].peaks[-1])
+                last_peak_ind = self.segments[-1].index(self.segments[-1].peaks[-1])
                 last_ind = len(self.segments[-1].frame_numbers) - 1
                 if last_ind - last_peak_ind > self.min_length_frames:
                     self.segments[-1].peaks.append(self.segments[-1].frame_numbers[-1])
 
     def _post_processing_segments(self):
-        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
-        frame_ptr = 0
+        segments_post_processed_peaks = []
         for segment in self.segments:
             post_processed_peaks = []
             for peak in segment.peaks:
-                peak_ind = segment.frame_numbers.index(peak)
+                peak_ind = segment.index(peak)
                 new_ind = max(0, peak_ind - self.back_down_frames)
                 post_processed_peaks.append(segment.frame_numbers[new_ind])
+            segments_post_processed_peaks.append(post_processed_peaks)
+
+        frames = self._get_frames(peak
+                                  for post_processed_peaks in segments_post_processed_peaks
+                                  if len(post_processed_peaks) > 1
+                                  for peak in post_processed_peaks)
 
+        for segment, post_processed_peaks in zip(self.segments, segments_post_processed_peaks):
             if len(post_processed_peaks) > 1:
                 last_frame_ind = post_processed_peaks[0]
                 segment.post_processed_peaks.append(last_frame_ind)
 
-                last_frame = self._get_next_frame_by_ptr(frame_ptr, last_frame_ind)
-                frame_ptr = last_frame_ind + 1
+                last_frame = frames[last_frame_ind]
 
                 for i in range(1, len(post_processed_peaks)):
                     rhs_frame_ind = post_processed_peaks[i]
-                    rhs_frame = self._get_next_frame_by_ptr(frame_ptr, rhs_frame_ind)
-                    frame_ptr = rhs_frame_ind + 1
+                    rhs_frame = frames[rhs_frame_ind]
                     absolute_cells_diff = self._get_frame_diff(last_frame, rhs_frame)
                     relative_cells_diff = self._absolute_to_relative_cells_diff(absolute_cells_diff,
                                                                                 segment.cells_thresholds)
@@ -500,19 +1292,15 @@ class VideoRecognitionCells(VideoRecognitionBase):
                 segment.post_processed_peaks = post_processed_peaks
 
     def _process_joints(self) -> List[int]:
-        self.cap.set(cv2.CAP_PROP_POS_AVI_RATIO, 0)
-        frame_ptr = 0
+        lhs_frame_inds = np.array([segment.frame_numbers[-1] for segment in self.segments[:-1]], dtype=np.int64)
+        rhs_frame_inds = np.array([segment.frame_numbers[0] for segment in self.segments[1:]], dtype=np.int64)
+        union_humans = RectangleArray.union(self.humans[lhs_frame_inds], self.humans[rhs_frame_inds])
+        absolute_cells_diffs = self._get_pairs_diffs(lhs_frame_inds, rhs_frame_inds, union_humans)
 
         res = []
         for i in range(1, len(self.segments)):
-            lhs_frame_ind = self.segments[i - 1].frame_numbers[-1]
-            rhs_frame_ind = self.segments[i].frame_numbers[0]
-            lhs_frame = self._get_next_frame_by_ptr(frame_ptr, lhs_frame_ind)
-            frame_ptr = lhs_frame_ind + 1
-            rhs_frame = self._get_next_frame_by_ptr(frame_ptr, rhs_frame_ind)
-            frame_ptr = rhs_frame_ind + 1
-            union_human = Rectangle.union(self.humans[lhs_frame_ind], self.humans[rhs_frame_ind])
-            absolute_cells_diff = self._get_frame_diff(lhs_frame, rhs_frame, union_human)
+            lhs_frame_ind = int(lhs_frame_inds[i - 1])
+            absolute_cells_diff = absolute_cells_diffs[i - 1]
 
             if self.segments[i - 1].kind == self.SegmentType.EMPTY:
                 cells_thresholds = self.segments[i - 1].cells_thresholds
@@ -557,47 +1345,48 @@ class VideoRecognitionCells(VideoRecognitionBase):
 
         return left_border <= human_center <= right_border
 
-    def _get_cells(self) -> List[List[Rectangle]]:
-        cell_width = int(self.width / self.n_cells_width)
-        cell_height = int(self.height / self.n_cells_height)
-
-        if self.width % self.n_cells_width != 0:
-            self.n_cells_width += 1
-
-        if self.height % self.n_cells_height != 0:
-            self.n_cells_height += 1
-
-        cells = [[] for _ in range(self.n_cells_height)]
-
-        for row_ind, row in enumerate(cells):
-            for col_ind in range(self.n_cells_width):
-                row.append(Rectangle(x=col_ind * cell_width,
-                                     y=row_ind * cell_height,
-                                     w=min(cell_width, self.width - col_ind * cell_width),
-                                     h=min(cell_height, self.height - row_ind * cell_height)))
-
-        return cells
+    def _get_next_frame(self, frame_positions: List[int] = None):
+        frame = self.frame_source.read()
+        if frame is not None:
+            if frame_positions is not None:
+                frame_positions.append(self.frame_source.position)
+            self.counters['frames_decoded'] += 1
+        return frame
 
-    def _get_next_frame(self):
-        frame = None
-        for i in range(self.frame_period):
-            ret, frame = self.cap.read()
-            if not ret:
-                return
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        return cv2.resize(frame, (0, 0), fx=self.resize_coef, fy=self.resize_coef)
+    def _skip_next_frame(self, frame_positions: List[int]) -> bool:
+        if not self.frame_source.skip():
+            return False
+        frame_positions.append(self.frame_source.position)
+        return True
 
     class Segment(object):
         def __init__(self, kind, frame_numbers: List[int] = None):
             self.frame_numbers = frame_numbers or []
             self.kind = kind
-            self.absolute_cells_diffs = []
-            self.cells_thresholds = []
-            self.relative_cells_diffs = []
-            self.diffs = []
+            self.absolute_cells_diffs = None
+            self.is_measured = None
+            self.cells_thresholds = None
+            self.relative_cells_diffs = None
+            self.diffs = None
             self.threshold = None
             self.peaks = []
             self.post_processed_peaks = []
+            self._positions = None
+
+        def set_frame_numbers(self, frame_numbers):
+            self.frame_numbers = np.asarray(frame_numbers, dtype=np.int64)
+            self._positions = np.full(int(self.frame_numbers[-1] - self.frame_numbers[0]) + 1, -1, dtype=np.int32)
+            self._positions[self.frame_numbers - self.frame_numbers[0]] = np.arange(len(self.frame_numbers))
+
+        def measured(self, values: np.ndarray) -> np.ndarray:
+            # values of the measured diffs, or all of them when none is measured
+            return values[self.is_measured] if np.any(self.is_measured) else values
+
+        def index(self, frame_number) -> int:
+            position = frame_number - self.frame_numbers[0]
+            if position < 0 or position >= len(self._positions) or self._positions[position] < 0:
+                raise ValueError('{} is not in segment'.format(frame_number))
+            return int(self._positions[position])
 
         def __str__(self):
             return 'Segment kind={}'.format(self.kind)
@@ -606,3 +1395,19 @@ class VideoRecognitionCells(VideoRecognitionBase):
         EMPTY = 1
         HUMAN_SIDE = 2
         HUMAN_CENTER = 3
+
+
+def _scan_video_shard(video_file_path: str, scan_kwargs: dict, first_frame: int, last_frame: int = None,
+                      humans: RectangleArray = None, frame_cache_args: tuple = None):
+    recognizer = VideoRecognitionCells(video_file_path, **scan_kwargs)
+    frame_buffer = FrameBuffer(recognizer.frame_buffer.capacity)
+    frame_cache = FrameCache(*frame_cache_args) if frame_cache_args is not None else None
+    try:
+        scan_result = recognizer._scan_range(first_frame, last_frame, humans, frame_buffer, frame_cache)
+    finally:
+        recognizer.frame_source.release()
+    written_frames = None
+    if frame_cache is not None:
+        frame_cache.flush()
+        written_frames = np.flatnonzero(frame_cache.is_written)
+    return scan_result, frame_buffer.items(), recognizer.counters, written_frames
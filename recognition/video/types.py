@@ -0,0 +1,15 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from .utils import RectangleArray
+
+# is_measured is False for the cells diffs approximated without decoding both frames
+ScanResult = NamedTuple('ScanResult', [('humans', RectangleArray),
+                                       ('cells_diffs', np.ndarray),
+                                       ('frame_positions', np.ndarray),
+                                       ('is_measured', np.ndarray)])
+
+# the packets of the video stream in display order, the key flag marks the frames decodable on their own
+Packets = NamedTuple('Packets', [('sizes', np.ndarray),
+                                 ('is_key', np.ndarray)])
@@ -1,12 +1,21 @@
+import heapq
+import os
+import tempfile
+from collections import OrderedDict
 from typing import List
 
 import cv2
 import dlib
+import numpy as np
 import pywt
 from scipy.signal import medfilt
 
+from .constants import IMAGE_HASH_SIZE
+
 
 class Rectangle(object):
+    __slots__ = ('x', 'y', 'w', 'h')
+
     def __init__(self, x=0, y=0, w=0, h=0):
         self.x = x
         self.y = y
@@ -29,7 +38,7 @@ class Rectangle(object):
             return Rectangle.from_rectangle(rhs_rect)
 
         if rhs_rect.is_empty():
-            return Rectangle.from_rectangle(rhs_rect)
+            return Rectangle.from_rectangle(lhs_rect)
 
         new_x = min(lhs_rect.x, rhs_rect.x)
         new_y = min(lhs_rect.y, rhs_rect.y)
@@ -51,55 +60,263 @@ class Rectangle(object):
         return 'rectangle: x = {}; y = {}; w = {}; h = {};'.format(self.x, self.y, self.w, self.h)
 
 
+# a sequence of rectangles as four int32 arrays, one rectangle per sampled frame of a video;
+# an integer index gives a Rectangle, a slice, an index array or a mask give a RectangleArray
+class RectangleArray(object):
+    __slots__ = ('x', 'y', 'w', 'h')
+
+    def __init__(self, x=(), y=(), w=(), h=()):
+        self.x = np.asarray(x, dtype=np.int32)
+        self.y = np.asarray(y, dtype=np.int32)
+        self.w = np.asarray(w, dtype=np.int32)
+        self.h = np.asarray(h, dtype=np.int32)
+
+    @staticmethod
+    def empty(n: int) -> 'RectangleArray':
+        return RectangleArray(*np.zeros((4, n), dtype=np.int32))
+
+    @staticmethod
+    def from_rectangles(rectangles) -> 'RectangleArray':
+        if isinstance(rectangles, RectangleArray):
+            return rectangles.copy()
+        values = np.array([(rect.x, rect.y, rect.w, rect.h) for rect in rectangles], dtype=np.int32).reshape((-1, 4))
+        return RectangleArray(*values.T)
+
+    @staticmethod
+    def concatenate(arrays: List['RectangleArray']) -> 'RectangleArray':
+        arrays = [RectangleArray.from_rectangles(array) for array in arrays]
+        return RectangleArray(*(np.concatenate([getattr(array, name) for array in arrays])
+                                for name in RectangleArray.__slots__))
+
+    def to_array(self) -> np.ndarray:
+        return np.stack((self.x, self.y, self.w, self.h), axis=1)
+
+    def copy(self) -> 'RectangleArray':
+        return RectangleArray(self.x.copy(), self.y.copy(), self.w.copy(), self.h.copy())
+
+    def __len__(self):
+        return len(self.x)
+
+    def __iter__(self):
+        for x, y, w, h in zip(self.x.tolist(), self.y.tolist(), self.w.tolist(), self.h.tolist()):
+            yield Rectangle(x, y, w, h)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Rectangle(int(self.x[index]), int(self.y[index]), int(self.w[index]), int(self.h[index]))
+        # a copy, as for a slice of a list
+        return RectangleArray(*(np.array(getattr(self, name)[index]) for name in self.__slots__))
+
+    def __setitem__(self, index, value):
+        if isinstance(value, Rectangle):
+            value = RectangleArray([value.x], [value.y], [value.w], [value.h])
+        elif not isinstance(value, RectangleArray):
+            value = RectangleArray.from_rectangles(value)
+        if isinstance(index, (int, np.integer)):
+            value = value[0]
+        for name in self.__slots__:
+            getattr(self, name)[index] = getattr(value, name)
+
+    def is_empty(self) -> np.ndarray:
+        return (self.w == 0) | (self.h == 0)
+
+    def scale(self, coef: float) -> 'RectangleArray':
+        return RectangleArray(*((getattr(self, name) * coef).astype(np.int32) for name in self.__slots__))
+
+    @staticmethod
+    def union(lhs: 'RectangleArray', rhs: 'RectangleArray') -> 'RectangleArray':
+        # the same as Rectangle.union for every pair
+        x1 = np.minimum(lhs.x, rhs.x)
+        y1 = np.minimum(lhs.y, rhs.y)
+        result = RectangleArray(x1, y1,
+                                np.maximum(lhs.x + lhs.w, rhs.x + rhs.w) - x1,
+                                np.maximum(lhs.y + lhs.h, rhs.y + rhs.h) - y1)
+        result[rhs.is_empty()] = lhs[rhs.is_empty()]
+        result[lhs.is_empty()] = rhs[lhs.is_empty()]
+        return result
+
+    @staticmethod
+    def intersection(lhs: 'RectangleArray', rhs: 'RectangleArray') -> 'RectangleArray':
+        # the common parts of the pairs, an empty rectangle for the pairs without one
+        x1 = np.maximum(lhs.x, rhs.x)
+        y1 = np.maximum(lhs.y, rhs.y)
+        w = np.maximum(0, np.minimum(lhs.x + lhs.w, rhs.x + rhs.w) - x1)
+        h = np.maximum(0, np.minimum(lhs.y + lhs.h, rhs.y + rhs.h) - y1)
+        is_empty = (w == 0) | (h == 0) | lhs.is_empty() | rhs.is_empty()
+        return RectangleArray(np.where(is_empty, 0, x1), np.where(is_empty, 0, y1),
+                              np.where(is_empty, 0, w), np.where(is_empty, 0, h))
+
+    @staticmethod
+    def is_intersect(lhs: 'RectangleArray', rhs: 'RectangleArray') -> np.ndarray:
+        # the same as Rectangle.is_intersect for every pair, the borders are included
+        return ~((rhs.y + rhs.h < lhs.y) | (rhs.x > lhs.x + lhs.w)
+                 | (rhs.y > lhs.y + lhs.h) | (rhs.x + rhs.w < lhs.x))
+
+    def interpolate(self, mask: np.ndarray) -> 'RectangleArray':
+        # the rectangles of the mask are replaced by the average of the closest non-empty rectangles
+        # before and after them, or by one of them at the ends; the rectangles are left if there are none
+        result = self.copy()
+        is_real = ~self.is_empty()
+        if not np.any(is_real) or not np.any(mask):
+            return result
+        inds = np.arange(len(self))
+        # the closest ones strictly before and after every rectangle, as the rectangle itself is replaced
+        left = np.concatenate(([-1], np.maximum.accumulate(np.where(is_real, inds, -1))[:-1]))
+        right = np.concatenate((np.minimum.accumulate(np.where(is_real, inds, len(self))[::-1])[::-1][1:],
+                                [len(self)]))
+        has_neighbours = (left >= 0) | (right < len(self))
+        mask = mask & has_neighbours
+        left = np.where(left < 0, right, left)
+        right = np.where(right >= len(self), left, right)
+        left, right = np.where(has_neighbours, left, inds), np.where(has_neighbours, right, inds)
+        for name in self.__slots__:
+            values = getattr(self, name)
+            getattr(result, name)[mask] = ((values[left] + values[right]) // 2)[mask]
+        return result
+
+    def median_filter(self, kernel_size: int = 15) -> 'RectangleArray':
+        # gaps shorter than a half of the kernel are filled in, the existence of a rectangle is smoothed
+        # by the median filter
+        is_real = ~self.is_empty()
+        if len(self) == 0:
+            return self.copy()
+        is_smoothed = medfilt(is_real.astype(np.float64), kernel_size) >= 0.5
+        return self.interpolate(is_smoothed & ~is_real)
+
+
+# keeps at most `capacity` frames, frames with the lowest priority are evicted first
+class FrameBuffer(object):
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.frames = {}
+        self._priorities = {}
+        self._heap = []
+
+    def add(self, index: int, frame, priority: float = float('inf')):
+        if self.capacity <= 0:
+            return
+        if priority <= self._priorities.get(index, float('-inf')):
+            return
+        self.frames[index] = frame
+        self._priorities[index] = priority
+        heapq.heappush(self._heap, (priority, index))
+
+        while len(self.frames) > self.capacity:
+            priority, index = heapq.heappop(self._heap)
+            if self._priorities.get(index) == priority:
+                del self.frames[index]
+                del self._priorities[index]
+
+    def get(self, index: int):
+        return self.frames.get(index)
+
+    def items(self):
+        return [(index, frame, self._priorities[index]) for index, frame in self.frames.items()]
+
+    def __contains__(self, index: int):
+        return index in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    def clear(self):
+        self.frames = {}
+        self._priorities = {}
+        self._heap = []
+
+
+# sampled frames in a memory-mapped file on disk, frames are read back without copying,
+# frames with index >= capacity are not kept; frames written by another process are marked with set_written
+class FrameCache(object):
+    def __init__(self, file_path: str, capacity: int, height: int, width: int, mode: str = 'r+'):
+        self.file_path = file_path
+        self.capacity = capacity
+        self.height = height
+        self.width = width
+        self.frames = np.memmap(file_path, dtype=np.uint8, mode=mode, shape=(max(1, capacity), height, width))
+        self.is_written = np.zeros(capacity, dtype=bool)
+
+    @staticmethod
+    def create(capacity: int, height: int, width: int, cache_dir: str = None) -> 'FrameCache':
+        fd, file_path = tempfile.mkstemp(suffix='.frames', dir=cache_dir)
+        os.close(fd)
+        return FrameCache(file_path, capacity, height, width, mode='w+')
+
+    def get_args(self) -> tuple:
+        # the arguments to open the same cache in another process
+        return self.file_path, self.capacity, self.height, self.width
+
+    def add(self, index: int, frame):
+        if index >= self.capacity:
+            return
+        self.frames[index] = frame
+        self.is_written[index] = True
+
+    def set_written(self, indices: np.ndarray):
+        self.is_written[indices] = True
+
+    def get(self, index: int):
+        if index not in self:
+            return None
+        return np.asarray(self.frames[index])
+
+    def __contains__(self, index: int):
+        return 0 <= index < self.capacity and bool(self.is_written[index])
+
+    def flush(self):
+        self.frames.flush()
+
+    def release(self):
+        self.frames = None
+        self.is_written[:] = False
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
 
 def median_filter_rectangles(rectangles: List[Rectangle], kernel_size: int = 15) -> List[Rectangle]:
-    real_rects_existance = list(map(lambda rect: 0 if rect.is_empty else 1, rectangles))
-    smoothed_rects_existance = list(map(round, medfilt(real_rects_existance, kernel_size)))
-    result = []
-    for i, (real, smoothed) in enumerate(zip(real_rects_existance, smoothed_rects_existance)):
-        if real == 0 and smoothed == 1:
-            rectangle = interpolate_rectangle(rectangles, i)
-        else:
-            rectangle = Rectangle.from_rectangle(rectangles[i])
-        result.append(rectangle)
-    return result
+    return list(RectangleArray.from_rectangles(rectangles).median_filter(kernel_size))
 
 def interpolate_rectangle(rectangles: List[Rectangle], index: int) -> Rectangle:
-    left_rectangle = None
-    for i in range(index - 1, 0, -1):
-        if not rectangles[i].is_empty():
-            left_rectangle = rectangles[i]
-            break
-
-    right_rectangle = None
-    for i in range(index + 1, len(rectangles)):
-        if not rectangles[i].is_empty():
-            right_rectangle = rectangles[i]
-            break
-
-    if not left_rectangle:
-        return Rectangle.from_rectangle(right_rectangle)
-
-    if not right_rectangle:
-        return Rectangle.from_rectangle(left_rectangle)
-
-    def average(a, b):
-        return (a + b) // 2
-
-    return Rectangle(x=average(left_rectangle.x, right_rectangle.x),
-                     y=average(left_rectangle.y, right_rectangle.y),
-                     h=average(left_rectangle.h, right_rectangle.h),
-                     w=average(left_rectangle.w, right_rectangle.w))
-
-def get_rectangle_with_human_dlib(image) -> Rectangle:
-    height, width = image.shape
-    detector = dlib.get_frontal_face_detector()
-    dets = detector(image, 1)
+    rectangles = RectangleArray.from_rectangles(rectangles)
+    mask = np.zeros(len(rectangles), dtype=bool)
+    mask[index] = True
+    return rectangles.interpolate(mask)[index]
+
+_face_detector = None
+_haar_cascades = {}
+
+
+def get_face_detector():
+    global _face_detector
+    if _face_detector is None:
+        _face_detector = dlib.get_frontal_face_detector()
+    return _face_detector
+
+
+def get_haar_cascade(haar_cascade_path: str):
+    # loaded cascades are shared, an empty one is returned if the file can not be loaded
+    if haar_cascade_path not in _haar_cascades:
+        cascade = cv2.CascadeClassifier(haar_cascade_path)
+        if cascade.empty():
+            return cascade
+        _haar_cascades[haar_cascade_path] = cascade
+    return _haar_cascades[haar_cascade_path]
+
+
+def detect_face_dlib(image, scale: float = 1, upsample_num_times: int = 1):
+    if scale != 1:
+        image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    dets = get_face_detector()(image, upsample_num_times)
     if len(dets) == 0:
-        return Rectangle()
+        return None
     det = dets[0]
-    x = det.left()
-    w = det.right() - x
+    return det.left() / scale, det.top() / scale, det.right() / scale, det.bottom() / scale
+
+
+def face_to_human_rectangle(face_left, face_right, image) -> Rectangle:
+    height, width = image.shape[:2]
+    x = face_left
+    w = face_right - face_left
     # new params
     center_x = x + w/2
     x_coef = 4
@@ -107,6 +324,53 @@ def get_rectangle_with_human_dlib(image) -> Rectangle:
     w = min(x_coef*w, (width - 1) - x)
     return Rectangle(x=int(x), y=0, w=int(w), h=height-1)
 
+
+def get_rectangle_with_human_dlib(image, scale: float = 1, upsample_num_times: int = 1) -> Rectangle:
+    face = detect_face_dlib(image, scale, upsample_num_times)
+    if face is None:
+        return Rectangle()
+    return face_to_human_rectangle(face[0], face[2], image)
+
+
+# runs the face detector every `detect_every` frames or on request,
+# between detections the face is followed by the dlib correlation tracker
+class HumanTracker(object):
+    def __init__(self, detect_every: int = 10, min_confidence: float = 7,
+                 scale: float = 1, upsample_num_times: int = 1):
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.scale = scale
+        self.upsample_num_times = upsample_num_times
+        self.tracker = None
+        self.frames_from_detection = detect_every
+        self.detector_calls = 0
+
+    def get_rectangle_with_human(self, image, force_detection: bool = False) -> Rectangle:
+        self.frames_from_detection += 1
+        if force_detection or self.frames_from_detection >= self.detect_every:
+            return self._detect(image)
+
+        if self.tracker is None:
+            return Rectangle()
+
+        if self.tracker.update(image) < self.min_confidence:
+            return self._detect(image)
+
+        position = self.tracker.get_position()
+        return face_to_human_rectangle(position.left(), position.right(), image)
+
+    def _detect(self, image) -> Rectangle:
+        self.frames_from_detection = 0
+        self.detector_calls += 1
+        face = detect_face_dlib(image, self.scale, self.upsample_num_times)
+        if face is None:
+            self.tracker = None
+            return Rectangle()
+
+        self.tracker = dlib.correlation_tracker()
+        self.tracker.start_track(image, dlib.rectangle(*map(int, face)))
+        return face_to_human_rectangle(face[0], face[2], image)
+
 def image_diff_canny(lhs_image, rhs_image, th1=100, th2=200) -> int:
     lhs_edges = cv2.Canny(lhs_image, th1, th2)
     rhs_edges = cv2.Canny(rhs_image, th1, th2)
@@ -131,12 +395,160 @@ def image_diff_color_hist(lhs_image, rhs_image) -> int:
         diff += cv2.absdiff(lhs_hist, rhs_hist).sum()
     return diff
 
+# a perceptual hash of a keyframe: the mean brightness of every block of a grid, images are near-duplicates
+# if no block differs by more than a few levels; unlike dHash bits it changes with a new line or word of a slide
+def get_image_hash(image, size=IMAGE_HASH_SIZE) -> np.ndarray:
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+# the whole-frame features of the image_diff functions, the difference of two features is reduced
+# to the values of the cells by CellsGrid, the same as image_diff gives for every cell of the grid
+def feature_map_canny(image, th1=100, th2=200):
+    return cv2.Canny(image, th1, th2)
+
+def feature_map_dwt(image):
+    _, (LH, HL, HH) = pywt.dwt2(image, 'haar')
+    return np.stack((LH, HL, HH), axis=-1)
+
+def feature_map_color_hist(image, n_bins=32):
+    # the number of the histogram bin of every pixel
+    return (image.astype(np.int64) * n_bins) >> 8
+
+class CellsGrid(object):
+    # the features of the last frames, a frame is usually the rhs of one pair and the lhs of the next one
+    feature_cache_size = 4
+
+    def __init__(self, width: int, height: int, n_cells_width: int, n_cells_height: int, scale: float = 1):
+        # frames of width x height are downscaled by scale before the diffs, the cells are of the downscaled frames
+        self.scale = scale
+        if scale != 1:
+            width, height = int(width * scale), int(height * scale)
+        self.width = width
+        self.height = height
+        self.cell_width = int(width / n_cells_width)
+        self.cell_height = int(height / n_cells_height)
+
+        if width % n_cells_width != 0:
+            n_cells_width += 1
+
+        if height % n_cells_height != 0:
+            n_cells_height += 1
+
+        self.n_cells_width = n_cells_width
+        self.n_cells_height = n_cells_height
+
+        self.cells = [[Rectangle(x=col_ind * self.cell_width,
+                                 y=row_ind * self.cell_height,
+                                 w=min(self.cell_width, width - col_ind * self.cell_width),
+                                 h=min(self.cell_height, height - row_ind * self.cell_height))
+                       for col_ind in range(n_cells_width)]
+                      for row_ind in range(n_cells_height)]
+
+        self._cells_x1 = np.array([cell.x for cell in self.cells[0]])
+        self._cells_x2 = np.array([cell.x + cell.w for cell in self.cells[0]])
+        self._cells_y1 = np.array([row[0].y for row in self.cells])
+        self._cells_y2 = np.array([row[0].y + row[0].h for row in self.cells])
+
+        # features of a frame and the reduction of the difference of two features to the cells
+        self._features = {
+            image_diff_canny: (feature_map_canny, lambda lhs, rhs: self.blocks_sum(cv2.absdiff(lhs, rhs))),
+            image_diff_dwt: (feature_map_dwt, lambda lhs, rhs: self.blocks_sum(np.abs(lhs - rhs), scale=0.5)),
+            image_diff_color_hist: (self._cells_histograms, lambda lhs, rhs: np.abs(lhs - rhs).sum(axis=(2, 3))),
+        }
+        self._feature_cache = OrderedDict()
+        self._cells_inds = None
+
+    def diff(self, lhs_image, rhs_image, image_diff=None, human: Rectangle = None) -> np.ndarray:
+        if self.scale != 1:
+            lhs_image = self._get_features(lhs_image, self._downscale)
+            rhs_image = self._get_features(rhs_image, self._downscale)
+            if human is not None:
+                human = Rectangle(*(int(value * self.scale) for value in (human.x, human.y, human.w, human.h)))
+        if image_diff is None or image_diff is image_diff_abs:
+            result = self.blocks_sum(cv2.absdiff(lhs_image, rhs_image))
+        elif image_diff in self._features:
+            get_features, features_diff = self._features[image_diff]
+            result = features_diff(self._get_features(lhs_image, get_features),
+                                   self._get_features(rhs_image, get_features))
+        else:
+            result = np.zeros((self.n_cells_height, self.n_cells_width))
+            for i, row in enumerate(self.cells):
+                for j, cell in enumerate(row):
+                    p1, p2 = cell.get_points()
+                    result[i, j] = image_diff(lhs_image[p1[1]:p2[1], p1[0]:p2[0]],
+                                              rhs_image[p1[1]:p2[1], p1[0]:p2[0]])
+
+        if human is not None:
+            result[self.intersection_mask(human)] = 0
+        return result
+
+    def blocks_sum(self, image, scale: float = 1) -> np.ndarray:
+        # sums of the image over every cell, the image is cropped or padded with zeros to the grid size;
+        # an image of another scale is summed over the cells of the same scale, it is cropped to the grid
+        # first, otherwise the last row and column of cells take everything after the grid
+        if scale != 1:
+            image = image[:int(np.ceil(self._cells_y2[-1] * scale)), :int(np.ceil(self._cells_x2[-1] * scale))]
+            rows = np.minimum((self._cells_y1 * scale).astype(np.int64), image.shape[0] - 1)
+            cols = np.minimum((self._cells_x1 * scale).astype(np.int64), image.shape[1] - 1)
+            result = np.add.reduceat(np.add.reduceat(image, rows, axis=0), cols, axis=1)
+            return result.sum(axis=tuple(range(2, result.ndim)))
+
+        height = self.n_cells_height * self.cell_height
+        width = self.n_cells_width * self.cell_width
+        image = image[:height, :width]
+        if image.shape[0] != height or image.shape[1] != width:
+            padding = [(0, height - image.shape[0]), (0, width - image.shape[1])] + [(0, 0)] * (image.ndim - 2)
+            image = np.pad(image, padding, mode='constant')
+
+        blocks = image.reshape((self.n_cells_height, self.cell_height, self.n_cells_width, self.cell_width)
+                               + image.shape[2:])
+        return blocks.sum(axis=(1, 3) + tuple(range(4, blocks.ndim)))
+
+    def _downscale(self, image):
+        return cv2.resize(image, (self.width, self.height), interpolation=cv2.INTER_AREA)
+
+    def _get_features(self, image, get_features):
+        # the cache holds the frames themselves, so the id of a cached frame is never reused by another one
+        key = (id(image), get_features)
+        if key in self._feature_cache and self._feature_cache[key][0] is image:
+            self._feature_cache.move_to_end(key)
+            return self._feature_cache[key][1]
+        features = get_features(image)
+        self._feature_cache[key] = (image, features)
+        while len(self._feature_cache) > self.feature_cache_size:
+            self._feature_cache.popitem(last=False)
+        return features
+
+    def _cells_histograms(self, image, n_bins=32) -> np.ndarray:
+        # histograms of every channel of every cell with the shape (n_cells_height, n_cells_width, channels, n_bins),
+        # the pixels after the last cells are not in any cell
+        image = image[:self._cells_y2[-1], :self._cells_x2[-1]]
+        if self._cells_inds is None or self._cells_inds.shape != image.shape[:2]:
+            rows = np.arange(image.shape[0]) // self.cell_height
+            cols = np.arange(image.shape[1]) // self.cell_width
+            self._cells_inds = (rows[:, np.newaxis] * self.n_cells_width + cols) * n_bins
+        bins = feature_map_color_hist(image, n_bins).reshape(image.shape[:2] + (-1,))
+        n_cells = self.n_cells_height * self.n_cells_width
+        histograms = [np.bincount((self._cells_inds + bins[:, :, i]).ravel(), minlength=n_cells * n_bins)
+                      for i in range(bins.shape[2])]
+        return np.stack(histograms, axis=1).reshape((self.n_cells_height, self.n_cells_width, -1, n_bins))
+
+    def intersection_mask(self, rectangle: Rectangle) -> np.ndarray:
+        # the same as Rectangle.is_intersect(rectangle, cell) for every cell
+        (x1, y1), (x2, y2) = rectangle.get_points()
+        cols = ~((self._cells_x1 > x2) | (self._cells_x2 < x1))
+        rows = ~((self._cells_y2 < y1) | (self._cells_y1 > y2))
+        return np.outer(rows, cols)
+
+
 def get_rectangle_with_human_opencv(image, haar_cascade_path) -> Rectangle:
-    cascade = cv2.CascadeClassifier(haar_cascade_path)
+    cascade = get_haar_cascade(haar_cascade_path)
     if cascade.empty():
         return Rectangle()
-    rects = cascade.detectMultiScale(image)
-    if len(rects) == 0:
-        return Rectangle()
-    print(rects)
+    # the bounding rectangle of everything the cascade finds
+    human = Rectangle()
+    for x, y, w, h in cascade.detectMultiScale(image):
+        human = Rectangle.union(human, Rectangle(x=int(x), y=int(y), w=int(w), h=int(h)))
+    return human
 
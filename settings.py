@@ -10,4 +10,6 @@ WIKI_BASE_URL = env('WIKI_BASE_URL')
 WIKI_API_PATH = env('WIKI_API_PATH', default='/api.php')
 
 UPLOAD_CARE_PUB_KEY = env('UPLOAD_CARE_PUB_KEY')
+KEYFRAMES_FORMAT = env('KEYFRAMES_FORMAT', default='png')
+KEYFRAMES_QUALITY = env.int('KEYFRAMES_QUALITY', default=None)
 YANDEX_SPEECH_KIT_KEY = env('YANDEX_SPEECH_KIT_KEY')
@@ -4,6 +4,7 @@ import logging
 from constants import SynopsisType, EMPTY_STEP_TEXT
 from exceptions import CreateSynopsisError
 from recognition.constants import ContentType
+from recognition.video.image_uploaders import SavedImages
 from utils import (make_synopsis_from_video, save_synopsis_for_lesson_to_wiki, get_stepik_client,
                    get_wiki_client, add_lesson_to_section, add_section_to_course)
 
@@ -97,15 +98,17 @@ def create_synopsis_for_lesson(lesson):
         'steps': []
     }
 
+    # keyframes of a slide shown in several steps are uploaded once
+    saved_images = SavedImages()
     for step_id in lesson['steps']:
         step = stepik_client.get_step(step_id)
-        synopsis['steps'].append(create_synopsis_for_step(step))
+        synopsis['steps'].append(create_synopsis_for_step(step, saved_images))
 
     logger.info('synopsis creation for lesson (id = %s) ended', lesson['id'])
     return synopsis
 
 
-def create_synopsis_for_step(step):
+def create_synopsis_for_step(step, saved_images=None):
     wiki_client = get_wiki_client()
 
     if wiki_client.is_page_for_step_exist(step):
@@ -125,7 +128,7 @@ def create_synopsis_for_step(step):
         ]
     elif block['video']:
         step_type = 'video'
-        content = make_synopsis_from_video(video=block['video'])
+        content = make_synopsis_from_video(video=block['video'], saved_images=saved_images)
     else:
         step_type = 'empty'
         content = [
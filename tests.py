@@ -1,16 +1,35 @@
 import json
 import os
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from unittest import TestCase
 from unittest.mock import patch
 
+import cv2
+import numpy as np
+import peakutils
 import re
 import requests
+from scipy.signal import medfilt
 from tornado.testing import AsyncHTTPTestCase
 
 from constants import (SynopsisType, SINGLE_DOLLAR_TO_MATH_PATTERN,
                        SINGLE_DOLLAR_TO_MATH_REPLACE, DOUBLE_DOLLAR_TO_MATH_PATTERN,
                        DOUBLE_DOLLAR_TO_MATH_REPLACE)
+from exceptions import CreateSynopsisError
+from recognition.audio.types import RecognizedChunk
 from recognition.constants import ContentType
+from recognition.utils import merge_audio_and_video
+from recognition.video.constants import MAX_KEYFRAME_PER_SEC, THRESHOLD_DELTA
+from recognition.video.feature_store import FeatureStore
+from recognition.video.image_uploaders import ImageSaverBase, ImageSaverUploadcare, SavedImages
+from recognition.video.recognizers import (VideoRecognitionBase, VideoRecognitionCells, VideoRecognitionNaive,
+                                           VideoRecognitionPackets)
+from recognition.video.types import Packets, ScanResult
+from recognition.video.utils import (CellsGrid, Rectangle, RectangleArray, image_diff_abs, image_diff_color_hist,
+                                    image_diff_dwt)
 from utils import save_synopsis_for_lesson_to_wiki
 from webserver import make_app
 
@@ -215,3 +234,571 @@ class RegexTest(TestCase):
         self.check_all_regex_cases(cases=cases,
                                    pattern=DOUBLE_DOLLAR_TO_MATH_PATTERN,
                                    replace=DOUBLE_DOLLAR_TO_MATH_REPLACE)
+
+
+class CellsGridTest(TestCase):
+    # frames which are padded or cropped to the grid in width, height or both
+    sizes = [(96, 54), (100, 57), (110, 52), (100, 52), (110, 57)]
+
+    @staticmethod
+    def per_cell_diff(cells_grid, lhs_image, rhs_image, image_diff, human=None):
+        # the per-cell loop CellsGrid.diff replaces
+        result = np.zeros((cells_grid.n_cells_height, cells_grid.n_cells_width))
+        for i, row in enumerate(cells_grid.cells):
+            for j, cell in enumerate(row):
+                if human is not None and Rectangle.is_intersect(human, cell):
+                    continue
+                p1, p2 = cell.get_points()
+                result[i, j] = image_diff(lhs_image[p1[1]:p2[1], p1[0]:p2[0]], rhs_image[p1[1]:p2[1], p1[0]:p2[0]])
+        return result
+
+    @staticmethod
+    def random_frames(width, height, channels=None, seed=0):
+        random_state = np.random.RandomState(seed)
+        shape = (height, width) if channels is None else (height, width, channels)
+        return tuple(random_state.randint(0, 256, shape).astype(np.uint8) for _ in range(2))
+
+    def test_abs_diff(self):
+        for width, height in self.sizes:
+            cells_grid = CellsGrid(width, height, 16, 9)
+            lhs_image, rhs_image = self.random_frames(width, height)
+            np.testing.assert_array_equal(self.per_cell_diff(cells_grid, lhs_image, rhs_image, image_diff_abs),
+                                          cells_grid.diff(lhs_image, rhs_image, image_diff_abs))
+
+    def test_abs_diff_with_human(self):
+        humans = [Rectangle(), Rectangle(0, 0, 10, 10), Rectangle(30, 0, 25, 51), Rectangle(95, 40, 30, 30),
+                  Rectangle(12, 10, 0, 5)]
+        for width, height in self.sizes:
+            cells_grid = CellsGrid(width, height, 16, 9)
+            lhs_image, rhs_image = self.random_frames(width, height)
+            for human in humans:
+                np.testing.assert_array_equal(self.per_cell_diff(cells_grid, lhs_image, rhs_image, image_diff_abs,
+                                                                 human),
+                                              cells_grid.diff(lhs_image, rhs_image, image_diff_abs, human))
+
+    def test_color_hist_diff(self):
+        for width, height in self.sizes:
+            cells_grid = CellsGrid(width, height, 16, 9)
+            for channels in (None, 3):
+                lhs_image, rhs_image = self.random_frames(width, height, channels)
+                np.testing.assert_array_equal(self.per_cell_diff(cells_grid, lhs_image, rhs_image,
+                                                                 image_diff_color_hist),
+                                              cells_grid.diff(lhs_image, rhs_image, image_diff_color_hist))
+
+    def test_dwt_diff(self):
+        # the whole-frame transform is the same as the one of every cell when the borders of the cells are even
+        for width, height, n_cells_width, n_cells_height in [(96, 54, 16, 9), (100, 60, 16, 9), (110, 58, 16, 9),
+                                                             (128, 72, 8, 4)]:
+            cells_grid = CellsGrid(width, height, n_cells_width, n_cells_height)
+            lhs_image, rhs_image = self.random_frames(width, height)
+            np.testing.assert_allclose(self.per_cell_diff(cells_grid, lhs_image, rhs_image, image_diff_dwt),
+                                       cells_grid.diff(lhs_image, rhs_image, image_diff_dwt))
+
+    def test_scaled_diff(self):
+        # a scaled grid is the grid of the downscaled frames, the human is scaled with them
+        cells_grid = CellsGrid(220, 114, 16, 9, scale=0.5)
+        lhs_image, rhs_image = self.random_frames(220, 114)
+        downscaled = [cv2.resize(image, (110, 57), interpolation=cv2.INTER_AREA) for image in (lhs_image, rhs_image)]
+        expected = CellsGrid(110, 57, 16, 9).diff(*downscaled, image_diff_abs, human=Rectangle(30, 0, 25, 51))
+        np.testing.assert_array_equal(expected,
+                                      cells_grid.diff(lhs_image, rhs_image, image_diff_abs, Rectangle(60, 0, 50, 102)))
+
+    def test_intersection_mask(self):
+        cells_grid = CellsGrid(110, 57, 16, 9)
+        random_state = np.random.RandomState(0)
+        for _ in range(100):
+            human = Rectangle(*random_state.randint(0, 120, 4))
+            expected = [[Rectangle.is_intersect(human, cell) for cell in row] for row in cells_grid.cells]
+            np.testing.assert_array_equal(expected, cells_grid.intersection_mask(human))
+
+    def test_other_image_diff(self):
+        # image_diff functions without a whole-frame feature still go through the per-cell loop
+        def image_diff_max(lhs_image, rhs_image):
+            return int(np.abs(lhs_image.astype(np.int64) - rhs_image).max())
+
+        cells_grid = CellsGrid(110, 57, 16, 9)
+        lhs_image, rhs_image = self.random_frames(110, 57)
+        np.testing.assert_array_equal(self.per_cell_diff(cells_grid, lhs_image, rhs_image, image_diff_max),
+                                      cells_grid.diff(lhs_image, rhs_image, image_diff_max))
+
+
+class RectangleArrayTest(TestCase):
+    @staticmethod
+    def random_rectangles(n, random_state):
+        # a quarter of the rectangles is empty, in width, height or both
+        rectangles = []
+        for _ in range(n):
+            x, y, w, h = random_state.randint(0, 50, 4).tolist()
+            if random_state.rand() < 0.25:
+                w, h = [(0, h), (w, 0), (0, 0)][random_state.randint(3)]
+            rectangles.append(Rectangle(x, y, w, h))
+        return rectangles
+
+    @staticmethod
+    def to_tuples(rectangles):
+        return [(rect.x, rect.y, rect.w, rect.h) for rect in rectangles]
+
+    @staticmethod
+    def intersection(lhs_rect, rhs_rect):
+        # the common part of two rectangles, computed point by point
+        if lhs_rect.is_empty() or rhs_rect.is_empty():
+            return Rectangle()
+        (lx1, ly1), (lx2, ly2) = lhs_rect.get_points()
+        (rx1, ry1), (rx2, ry2) = rhs_rect.get_points()
+        x1, y1, x2, y2 = max(lx1, rx1), max(ly1, ry1), min(lx2, rx2), min(ly2, ry2)
+        if x2 <= x1 or y2 <= y1:
+            return Rectangle()
+        return Rectangle(x1, y1, x2 - x1, y2 - y1)
+
+    @staticmethod
+    def interpolate(rectangles, index):
+        # the average of the closest non-empty rectangles before and after the index, or one of them
+        left = next((rect for rect in rectangles[index - 1::-1] if not rect.is_empty()), None) if index else None
+        right = next((rect for rect in rectangles[index + 1:] if not rect.is_empty()), None)
+        if left is None and right is None:
+            return Rectangle.from_rectangle(rectangles[index])
+        left, right = left or right, right or left
+        return Rectangle((left.x + right.x) // 2, (left.y + right.y) // 2,
+                         (left.w + right.w) // 2, (left.h + right.h) // 2)
+
+    def test_union(self):
+        random_state = np.random.RandomState(0)
+        lhs, rhs = self.random_rectangles(500, random_state), self.random_rectangles(500, random_state)
+        expected = [Rectangle.union(lhs_rect, rhs_rect) for lhs_rect, rhs_rect in zip(lhs, rhs)]
+        result = RectangleArray.union(RectangleArray.from_rectangles(lhs), RectangleArray.from_rectangles(rhs))
+        self.assertEqual(self.to_tuples(expected), self.to_tuples(result))
+
+    def test_union_with_empty(self):
+        rect = Rectangle(10, 20, 30, 40)
+        for empty in (Rectangle(), Rectangle(5, 5, 0, 10), Rectangle(5, 5, 10, 0)):
+            self.assertEqual(self.to_tuples([rect]), self.to_tuples([Rectangle.union(rect, empty)]))
+            self.assertEqual(self.to_tuples([rect]), self.to_tuples([Rectangle.union(empty, rect)]))
+            result = RectangleArray.union(RectangleArray.from_rectangles([rect, empty]),
+                                          RectangleArray.from_rectangles([empty, rect]))
+            self.assertEqual(self.to_tuples([rect, rect]), self.to_tuples(result))
+
+    def test_intersection(self):
+        random_state = np.random.RandomState(1)
+        lhs, rhs = self.random_rectangles(500, random_state), self.random_rectangles(500, random_state)
+        expected = [self.intersection(lhs_rect, rhs_rect) for lhs_rect, rhs_rect in zip(lhs, rhs)]
+        result = RectangleArray.intersection(RectangleArray.from_rectangles(lhs),
+                                             RectangleArray.from_rectangles(rhs))
+        self.assertEqual(self.to_tuples(expected), self.to_tuples(result))
+
+    def test_is_intersect(self):
+        random_state = np.random.RandomState(2)
+        lhs, rhs = self.random_rectangles(500, random_state), self.random_rectangles(500, random_state)
+        expected = [Rectangle.is_intersect(lhs_rect, rhs_rect) for lhs_rect, rhs_rect in zip(lhs, rhs)]
+        result = RectangleArray.is_intersect(RectangleArray.from_rectangles(lhs), RectangleArray.from_rectangles(rhs))
+        self.assertEqual(expected, result.tolist())
+
+    def test_interpolate(self):
+        random_state = np.random.RandomState(3)
+        for n in (1, 2, 10, 100):
+            rectangles = self.random_rectangles(n, random_state)
+            mask = random_state.rand(n) < 0.5
+            expected = [self.interpolate(rectangles, i) if mask[i] else rect for i, rect in enumerate(rectangles)]
+            result = RectangleArray.from_rectangles(rectangles).interpolate(mask)
+            self.assertEqual(self.to_tuples(expected), self.to_tuples(result))
+
+    def test_interpolate_without_real_rectangles(self):
+        rectangles = [Rectangle(), Rectangle(1, 2, 0, 3)]
+        result = RectangleArray.from_rectangles(rectangles).interpolate(np.ones(2, dtype=bool))
+        self.assertEqual(self.to_tuples(rectangles), self.to_tuples(result))
+
+    def test_median_filter(self):
+        random_state = np.random.RandomState(4)
+        for n, kernel_size in [(0, 15), (1, 3), (30, 5), (200, 15)]:
+            # runs of rectangles and gaps, so that the filter both fills gaps and leaves them
+            rectangles = [rect if random_state.rand() < 0.7 else Rectangle()
+                          for rect in self.random_rectangles(n, random_state)]
+            is_real = [0 if rect.is_empty() else 1 for rect in rectangles]
+            is_smoothed = medfilt(np.array(is_real, dtype=np.float64), kernel_size) if n else []
+            expected = [self.interpolate(rectangles, i) if not is_real[i] and is_smoothed[i] >= 0.5 else rect
+                        for i, rect in enumerate(rectangles)]
+            result = RectangleArray.from_rectangles(rectangles).median_filter(kernel_size)
+            self.assertEqual(self.to_tuples(expected), self.to_tuples(result))
+
+
+class FeatureStoreTest(TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+        self.store = FeatureStore(self.store_dir.name)
+        # only the bytes of the video are hashed, they are not decoded
+        self.video_file_path = os.path.join(self.store_dir.name, 'video.mp4')
+        with open(self.video_file_path, 'wb') as f:
+            f.write(b'video')
+        self.scan_result = ScanResult(humans=RectangleArray.from_rectangles([Rectangle(), Rectangle(10, 20, 30, 40)]),
+                                      cells_diffs=np.arange(2 * 9 * 16, dtype=np.float32).reshape((2, 9, 16)),
+                                      frame_positions=np.array([2, 5], dtype=np.int64),
+                                      is_measured=np.array([True, False]))
+
+    def tearDown(self):
+        self.store_dir.cleanup()
+
+    def test_round_trip(self):
+        params = dict(resize_coef=0.5, max_sampling_step=8)
+        self.store.save(self.video_file_path, params, self.scan_result)
+        scan_result = self.store.load(self.video_file_path, params)
+        np.testing.assert_array_equal(self.scan_result.humans.to_array(), scan_result.humans.to_array())
+        np.testing.assert_array_equal(self.scan_result.cells_diffs, scan_result.cells_diffs)
+        np.testing.assert_array_equal(self.scan_result.frame_positions, scan_result.frame_positions)
+        np.testing.assert_array_equal(self.scan_result.is_measured, scan_result.is_measured)
+
+    def test_params_do_not_share_file(self):
+        self.store.save(self.video_file_path, dict(resize_coef=0.5), self.scan_result)
+        self.assertIsNone(self.store.load(self.video_file_path, dict(resize_coef=0.25)))
+        self.assertIsNone(self.store.load(self.video_file_path, dict(resize_coef=0.5, max_sampling_step=8)))
+        self.assertIsNotNone(self.store.load(self.video_file_path, dict(resize_coef=0.5)))
+
+
+class VideoRecognitionPacketsTest(TestCase):
+    def setUp(self):
+        # a minute of 25 fps with a key frame every 250 frames, the encoder forces one at 700 and starts
+        # its interval again from it; the P packets at 400, 450 and 1100 are larger than the ones around them
+        self.recognizer = VideoRecognitionPackets.__new__(VideoRecognitionPackets)
+        self.recognizer.fps = 25
+        self.recognizer.min_length_frames = 100
+        self.recognizer.back_down_frames = 25
+        self.recognizer.size_threshold_coef = 3
+        self.recognizer.window_frames = 50
+        self.recognizer.max_frames_per_min = None
+        sizes = np.full(1500, 1000)
+        is_key = np.zeros(1500, dtype=bool)
+        is_key[[0, 250, 500, 700, 950, 1200, 1450]] = True
+        sizes[is_key] = 20000
+        sizes[[400, 450, 1100]] = [8000, 5000, 4000]
+        self.recognizer.scores = self.recognizer._compute_scores(Packets(sizes=sizes, is_key=is_key))
+
+    def test_scores(self):
+        scores = self.recognizer.scores
+        self.assertEqual(8, scores[400])
+        self.assertEqual(np.inf, scores[700])
+        self.assertEqual([0, 0, 0, 0, 0, 0], scores[[0, 250, 500, 950, 1200, 1450]].tolist())
+        self.assertEqual(1, scores[300])
+
+    def test_changes(self):
+        # 450 is closer than min_length_frames to 400
+        self.assertEqual([400, 700, 1100], self.recognizer.get_changes())
+        self.assertEqual([400, 700], self.recognizer.get_changes(max_frames_per_min=2))
+
+    def test_keyframes(self):
+        self.assertEqual([375, 675, 1075, 1474], self.recognizer.get_keyframes())
+
+
+class VideoRecognitionCellsTest(TestCase):
+    @staticmethod
+    def make_recognizer(humans, cells_diffs, is_measured):
+        # a recognizer with the given humans and diffs instead of the ones of a video of 320x180,
+        # the frames are their numbers and every computed diff is 1 in every cell
+        recognizer = VideoRecognitionCells.__new__(VideoRecognitionCells)
+        recognizer.width, recognizer.height = 320, 180
+        recognizer.n_cells_width, recognizer.n_cells_height = 16, 9
+        recognizer.min_length_frames = 2
+        recognizer.cell_threshold_coef = 4
+        recognizer.humans = RectangleArray.from_rectangles(humans)
+        recognizer.cells_diffs = np.asarray(cells_diffs, dtype=np.float32)
+        recognizer.is_measured = np.asarray(is_measured, dtype=bool)
+        recognizer.segments = []
+        recognizer._get_frames = lambda frame_numbers: {frame_number: frame_number for frame_number in frame_numbers}
+        recognizer._get_frame_diff = lambda lhs_frame, rhs_frame, human=None: np.ones((9, 16), dtype=np.float32)
+        return recognizer
+
+    @staticmethod
+    def write_slides_video(file_path, changes_sec, n_sec=40, fps=25, seed=0):
+        # slides of random blocks which change at changes_sec, every frame has its own faint noise
+        random_state = np.random.RandomState(seed)
+        writer = cv2.VideoWriter(file_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (160, 96))
+        slide = None
+        for frame_number in range(n_sec * fps):
+            if frame_number == 0 or frame_number / fps in changes_sec:
+                slide = cv2.resize(random_state.randint(0, 256, (6, 10, 3)).astype(np.uint8), (160, 96),
+                                   interpolation=cv2.INTER_NEAREST)
+            noise = random_state.randint(-2, 3, slide.shape)
+            writer.write(np.clip(slide + noise, 0, 255).astype(np.uint8))
+        writer.release()
+
+    def test_adaptive_sampling(self):
+        with tempfile.TemporaryDirectory() as videos_dir:
+            video_file_path = os.path.join(videos_dir, 'slides.avi')
+            self.write_slides_video(video_file_path, changes_sec=[7, 15, 23, 33])
+            keyframes = VideoRecognitionCells(video_file_path, resize_coef=1).get_keyframes()
+            adaptive = VideoRecognitionCells(video_file_path, resize_coef=1, max_sampling_step=8)
+            self.assertEqual(keyframes, adaptive.get_keyframes())
+            self.assertLess(adaptive.counters['detector_calls'], len(adaptive.frame_positions))
+
+    def test_frame_source_released(self):
+        with tempfile.TemporaryDirectory() as videos_dir:
+            video_file_path = os.path.join(videos_dir, 'slides.avi')
+            self.write_slides_video(video_file_path, changes_sec=[3, 7], n_sec=10)
+            recognizer = VideoRecognitionCells(video_file_path, resize_coef=1)
+            keyframes = recognizer.get_keyframes()
+            self.assertFalse(recognizer.frame_source.cap.isOpened())
+            # the rescan opens the video again
+            recognizer.resize_coef = 0.5
+            self.assertEqual(keyframes, recognizer.get_keyframes())
+            self.assertLess(0, recognizer.counters['frames_decoded'])
+            self.assertFalse(recognizer.frame_source.cap.isOpened())
+
+    def test_max_buffered_bytes(self):
+        with tempfile.TemporaryDirectory() as videos_dir:
+            video_file_path = os.path.join(videos_dir, 'slides.avi')
+            self.write_slides_video(video_file_path, changes_sec=[3, 7], n_sec=10)
+            keyframes = VideoRecognitionCells(video_file_path, resize_coef=1).get_keyframes()
+            # the frames which do not fit are decoded again
+            recognizer = VideoRecognitionCells(video_file_path, resize_coef=1, max_buffered_bytes=160 * 96 * 2)
+            self.assertEqual(2, recognizer.frame_buffer.capacity)
+            self.assertEqual(keyframes, recognizer.get_keyframes())
+            self.assertLessEqual(len(recognizer.frame_buffer), 2)
+
+    def test_nearest_inds(self):
+        coarse_positions = np.array([11, 23, 35])
+        frame_positions = np.array([2, 5, 8, 11, 14, 17, 20, 23, 26, 29, 32, 35, 38])
+        self.assertEqual([0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2],
+                         VideoRecognitionCells._get_nearest_inds(coarse_positions, frame_positions).tolist())
+        self.assertEqual([0, 0], VideoRecognitionCells._get_nearest_inds(np.array([11]), np.array([2, 20])).tolist())
+
+    def test_spanning_inds(self):
+        # the fine diffs starting at 14, 17 and 20 are inside the coarse diff 11 -> 23
+        coarse_positions = np.array([11, 23, 35, 47])
+        frame_positions = np.array([2, 5, 8, 11, 14, 17, 20, 23, 26, 29, 32, 35, 38, 47, 50])
+        self.assertEqual([0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2],
+                         VideoRecognitionCells._get_spanning_inds(coarse_positions, frame_positions).tolist())
+
+    def test_measured_diffs_of_merged_segment(self):
+        # the human in the center splits the empty frames, both parts are joined into one segment
+        # with the pair (7, 10) computed from the frames
+        humans = [Rectangle()] * 8 + [Rectangle(140, 0, 40, 100)] * 2 + [Rectangle()] * 10
+        cells_diffs = np.ones((19, 9, 16))
+        is_measured = np.ones(19, dtype=bool)
+        is_measured[[2, 3, 4, 12, 13, 14]] = False
+        cells_diffs[~is_measured] = 1000
+        cells_diffs[[0, 15]] = 3
+        recognizer = self.make_recognizer(humans, cells_diffs, is_measured)
+        recognizer._compute_segments()
+        recognizer._compute_cells_diffs()
+        recognizer._compute_cells_thresholds()
+
+        segment, = recognizer.segments
+        self.assertEqual(list(range(8)) + list(range(10, 20)), segment.frame_numbers.tolist())
+        expected = is_measured[list(range(7)) + [7] + list(range(10, 19))]
+        expected[7] = True
+        self.assertEqual(expected.tolist(), segment.is_measured.tolist())
+        measured = segment.absolute_cells_diffs[expected]
+        np.testing.assert_allclose(measured.mean(axis=0) + 4 * measured.std(axis=0), segment.cells_thresholds)
+
+
+class NaivePeaksTest(TestCase):
+    @staticmethod
+    def make_recognizer(random_state):
+        # a recognizer with random diffs and humans instead of the ones of a video
+        recognizer = VideoRecognitionNaive.__new__(VideoRecognitionNaive)
+        n_diffs = random_state.randint(1, 400)
+        recognizer.fps = 25
+        recognizer.frame_period = 3
+        recognizer.num_of_frames = random_state.randint(1, 3 * n_diffs + 1)
+        recognizer.frames_between_keyframes = random_state.randint(1, 40)
+        recognizer.threshold = random_state.uniform(0, 0.5)
+        recognizer.shape = VideoRecognitionNaive._Shape(width=640, height=360)
+        recognizer.diffs = list(random_state.exponential(1, n_diffs) * (random_state.rand(n_diffs) < 0.3))
+        recognizer.bottom_line = float(np.mean(recognizer.diffs) * random_state.uniform(1, 4))
+        recognizer.humans = []
+        for _ in range(n_diffs + 1):
+            x_min = random_state.randint(0, 640)
+            w = random_state.randint(0, 300) if random_state.rand() < 0.5 else 0
+            recognizer.humans.append(VideoRecognitionNaive._Human(x_min=x_min, x_max=x_min + w, w=w))
+        recognizer.peaks = []
+        return recognizer
+
+    @staticmethod
+    def find_peaks_by_threshold(recognizer):
+        # the loop over the thresholds with peakutils.indexes for every threshold, which _find_peaks replaces
+        def last_sec_video_is_bad(ind):
+            if ind < recognizer.frames_between_keyframes:
+                return True
+            video_frame = 0
+            human_in_center_frames = 0
+            for i in range(1, recognizer.frames_between_keyframes):
+                if recognizer.diffs[ind - i] > recognizer.bottom_line:
+                    video_frame += 1
+                human = recognizer.humans[ind - i]
+                if human.w > 0:
+                    center = human.x_min + human.w / 2
+                    if 0.4 * recognizer.shape.width <= center <= 0.6 * recognizer.shape.width:
+                        human_in_center_frames += 1
+            return max(video_frame, human_in_center_frames) > recognizer.frames_between_keyframes // 2
+
+        peaks = []
+        threshold = recognizer.threshold
+        first_try = True
+        max_num_of_keyframe = max(MAX_KEYFRAME_PER_SEC * recognizer.num_of_frames / recognizer.fps, 1)
+        while (len(peaks) > max_num_of_keyframe or first_try) and threshold <= 1:
+            peaks = peakutils.indexes(np.array(recognizer.diffs), thres=threshold,
+                                      min_dist=recognizer.frames_between_keyframes)
+            if len(peaks) == 0 or len(recognizer.diffs) - peaks[-1] > recognizer.frames_between_keyframes:
+                peaks = np.append(peaks, [len(recognizer.diffs) - 1])
+            peaks = [int(peak) for peak in peaks if not last_sec_video_is_bad(peak)]
+            threshold += THRESHOLD_DELTA
+            first_try = False
+        return peaks
+
+    def test_find_peaks(self):
+        random_state = np.random.RandomState(0)
+        for _ in range(200):
+            recognizer = self.make_recognizer(random_state)
+            recognizer._find_peaks()
+            self.assertEqual(self.find_peaks_by_threshold(recognizer), [int(peak) for peak in recognizer.peaks])
+
+    def test_find_peaks_with_more_peaks_for_higher_threshold(self):
+        # the peak at 37 is in a video and near the end, the last frame is appended once it drops out,
+        # so there are more peaks for the threshold 0.94 than for 0.92
+        recognizer = self.make_recognizer(np.random.RandomState(0))
+        recognizer.num_of_frames = 120
+        recognizer.frames_between_keyframes = 6
+        recognizer.threshold = 0.9
+        recognizer.diffs = [0.0] * 40
+        recognizer.diffs[10], recognizer.diffs[20], recognizer.diffs[37] = 1.0, 0.905, 0.93
+        recognizer.diffs[32:36] = [0.1, 0.2, 0.3, 0.4]
+        recognizer.bottom_line = 0.05
+        recognizer.humans = [VideoRecognitionNaive._Human(x_min=0, x_max=0, w=0) for _ in range(41)]
+        recognizer._find_peaks()
+        self.assertEqual([10], self.find_peaks_by_threshold(recognizer))
+        self.assertEqual([10], [int(peak) for peak in recognizer.peaks])
+
+
+class FakeUploadServer(ThreadingMixIn, HTTPServer):
+    # answers like the upload API of Uploadcare, the first upload of every file in fail_once gets 503
+    daemon_threads = True
+
+    def __init__(self, fail_once):
+        super().__init__(('127.0.0.1', 0), FakeUploadHandler)
+        self.fail_once = set(fail_once)
+        self.uploads = []
+        self.lock = threading.Lock()
+
+
+class FakeUploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        filename = re.search(rb'filename="([^"]+)"', body).group(1).decode()
+        with self.server.lock:
+            failed = filename in self.server.fail_once
+            self.server.fail_once.discard(filename)
+            self.server.uploads.append(filename)
+        if failed:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        response = json.dumps({'file': 'uuid-' + filename}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ImageSaverUploadcareTest(TestCase):
+    def setUp(self):
+        self.server = FakeUploadServer(fail_once=['3.png'])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saver = ImageSaverUploadcare(pub_key='demopublickey',
+                                          url_to_upload='http://127.0.0.1:{}/base/'.format(self.server.server_port),
+                                          n_threads=4,
+                                          backoff_sec=0)
+
+    def tearDown(self):
+        self.saver.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_save_many(self):
+        srcs = self.saver.save_many((b'image', position) for position in range(10))
+        self.assertEqual(['https://ucarecdn.com/uuid-{}.png/'.format(position) for position in range(10)], srcs)
+        self.assertEqual(2, self.server.uploads.count('3.png'))
+        self.assertEqual(11, len(self.server.uploads))
+
+    def test_failed_upload(self):
+        self.saver.number_of_retries = 0
+        with self.assertRaises(CreateSynopsisError):
+            self.saver.save(b'image', 3)
+        self.assertEqual(['3.png'], self.server.uploads)
+
+    def test_connection_error_retries(self):
+        # only the retries of the saver are made, the session does not retry on its own
+        self.saver.number_of_retries = 2
+        with patch('urllib3.util.connection.create_connection', side_effect=ConnectionRefusedError) as connect:
+            with self.assertRaises(CreateSynopsisError):
+                self.saver.save(b'image', 0)
+        self.assertEqual(3, connect.call_count)
+
+
+class StubImageSaver(ImageSaverBase):
+    def __init__(self):
+        super().__init__()
+        self.positions = []
+
+    def save(self, image: memoryview, position: int) -> str:
+        self.positions.append(position)
+        return 'src{}'.format(position)
+
+
+class SaveKeyframesTest(TestCase):
+    def setUp(self):
+        self.saver = StubImageSaver()
+
+    def save_keyframes(self, frames, saved_images=None):
+        # frames are the brightness of uniform frames by their positions, the video has 25 fps
+        recognizer = VideoRecognitionBase.__new__(VideoRecognitionBase)
+        recognizer.fps = 25
+        recognizer.image_saver = self.saver
+        recognizer._read_frames = lambda positions: (np.full((180, 320), frames[position], dtype=np.uint8)
+                                                     for position in positions)
+        return recognizer.save_keyframes(frames.keys(), saved_images=saved_images)
+
+    def test_run_collapses_to_last_keyframe(self):
+        keyframes = self.save_keyframes({10: 50, 20: 52, 30: 50, 40: 150})
+        self.assertEqual([['src30', 1.2], ['src40', 1.6]], keyframes)
+        self.assertEqual([30, 40], self.saver.positions)
+
+    def test_drifting_run_splits(self):
+        # every frame is the same as the previous one, but 62 is not the same as the first one of the run
+        keyframes = self.save_keyframes({10: 50, 20: 56, 30: 62, 40: 68})
+        self.assertEqual([['src20', 0.8], ['src40', 1.6]], keyframes)
+        self.assertEqual([20, 40], self.saver.positions)
+
+    def test_duplicate_reuses_earlier_src(self):
+        keyframes = self.save_keyframes({10: 50, 20: 150, 30: 50})
+        self.assertEqual([['src10', 0.4], ['src20', 0.8], ['src10', 1.2]], keyframes)
+        self.assertEqual([10, 20], self.saver.positions)
+
+    def test_shared_saved_images(self):
+        saved_images = SavedImages()
+        self.save_keyframes({10: 50}, saved_images)
+        keyframes = self.save_keyframes({50: 50, 60: 150}, saved_images)
+        self.assertEqual([['src10', 2.0], ['src60', 2.4]], keyframes)
+        self.assertEqual([10, 60], self.saver.positions)
+
+
+class MergeAudioAndVideoTest(TestCase):
+    def test_consecutive_duplicates(self):
+        # the timestamps of the keyframes are the ends of the slides
+        keyframes = [['a', 1], ['a', 2], ['b', 3], ['b', 4]]
+        recognized_audio = [RecognizedChunk(1.5, 2.5, 'text')]
+        content = merge_audio_and_video(keyframes, recognized_audio)
+        self.assertEqual([{'type': ContentType.IMG, 'content': 'a'},
+                          {'type': ContentType.TEXT, 'content': 'text'},
+                          {'type': ContentType.IMG, 'content': 'b'}], content)
+
+    def test_duplicate_after_text(self):
+        keyframes = [['a', 1], ['a', 2]]
+        recognized_audio = [RecognizedChunk(0.5, 1, 'text')]
+        content = merge_audio_and_video(keyframes, recognized_audio)
+        self.assertEqual([{'type': ContentType.IMG, 'content': 'a'},
+                          {'type': ContentType.TEXT, 'content': 'text'},
+                          {'type': ContentType.IMG, 'content': 'a'}], content)
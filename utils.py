@@ -26,7 +26,7 @@ from recognition.audio.constants import Language
 from recognition.audio.recognizers import AudioRecognitionYandex
 from recognition.constants import ContentType
 from recognition.utils import merge_audio_and_video
-from recognition.video.image_uploaders import ImageSaverUploadcare
+from recognition.video.image_uploaders import ImageSaverUploadcare, ImageFormat
 from recognition.video.recognizers import VideoRecognitionCells
 
 logger = logging.getLogger(__name__)
@@ -84,7 +84,7 @@ def parse_arguments():
     return args
 
 
-def make_synopsis_from_video(video):
+def make_synopsis_from_video(video, saved_images=None):
     with tempfile.TemporaryDirectory() as tmpdir:
         videofile = os.path.join(tmpdir, 'tmp.mp4')
 
@@ -112,10 +112,14 @@ def make_synopsis_from_video(video):
 
             recognized_audio = ar.recognize()
 
-            uploadcare_saver = ImageSaverUploadcare(pub_key=settings.UPLOAD_CARE_PUB_KEY)
+            image_format = ImageFormat.from_quality(settings.KEYFRAMES_FORMAT, settings.KEYFRAMES_QUALITY)
+            uploadcare_saver = ImageSaverUploadcare(pub_key=settings.UPLOAD_CARE_PUB_KEY, image_format=image_format)
             vr = VideoRecognitionCells(video_file_path=videofile,
                                        image_saver=uploadcare_saver)
-            keyframes_src_with_timestamp = vr.get_keyframes_src_with_timestamp()
+            try:
+                keyframes_src_with_timestamp = vr.get_keyframes_src_with_timestamp(saved_images)
+            finally:
+                uploadcare_saver.close()
 
             content = merge_audio_and_video(keyframes_src_with_timestamp,
                                             recognized_audio)